@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+""" ACME Samples Statistics Functions
+
+Compute statistics (min, max, average) of captured samples, either
+scaled (float) samples or raw (int16) samples, the latter using integer
+arithmetic only (exact and faster).
+
+Numba (http://numba.pydata.org) is used when available, to compute all
+statistics in a single pass over the samples (JIT-compiled loop).
+Fall back to numpy otherwise.
+Numba kernels release the GIL, so that several slots may be processed
+in parallel threads.
+
+"""
+
+
+import numpy as np
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+__app_name__ = "ACME Samples Statistics Library"
+__license__ = "MIT"
+__copyright__ = "Copyright 2018, Baylibre SAS"
+__date__ = "2018/03/01"
+__author__ = "Patrick Titiano"
+__email__ = "ptitiano@baylibre.com"
+__contact__ = "ptitiano@baylibre.com"
+__maintainer__ = "Patrick Titiano"
+__status__ = "Development"
+__version__ = "0.1"
+__deprecated__ = False
+
+
+# Samples processed per block by numpy fallback (fits in L2 cache)
+_BLOCK_SIZE = 65536
+
+
+def _vip_stats_loop(vbat, ishunt):
+    """ Compute Vbat, Ishunt and Power (Vbat * Ishunt / 1000) statistics,
+        in a single loop over Vbat and Ishunt samples (Numba kernel).
+
+    Args:
+        vbat (numpy array): Vbat samples (in mV)
+        ishunt (numpy array): Ishunt samples (in mA)
+
+    Returns:
+        tuple: (Vbat min, Vbat max, Vbat avg,
+                Ishunt min, Ishunt max, Ishunt avg,
+                Power min, Power max, Power avg)
+
+    """
+    # Track Vbat * Ishunt products, and only divide the results by 1000
+    # (no division in the loop, min/max are the same)
+    v_min = v_max = vbat[0]
+    i_min = i_max = ishunt[0]
+    p_min = p_max = vbat[0] * ishunt[0]
+    v_sum = 0.0
+    i_sum = 0.0
+    p_sum = 0.0
+    for j in range(vbat.shape[0]):
+        v = vbat[j]
+        i = ishunt[j]
+        p = v * i
+        v_min = min(v_min, v)
+        v_max = max(v_max, v)
+        i_min = min(i_min, i)
+        i_max = max(i_max, i)
+        p_min = min(p_min, p)
+        p_max = max(p_max, p)
+        v_sum += v
+        i_sum += i
+        p_sum += p
+    n = vbat.shape[0]
+    return (v_min, v_max, v_sum / n,
+            i_min, i_max, i_sum / n,
+            p_min / 1000.0, p_max / 1000.0, p_sum / n / 1000.0)
+
+
+def _vip_stats_numpy(vbat, ishunt):
+    """ Compute Vbat, Ishunt and Power (Vbat * Ishunt / 1000) statistics,
+        using numpy reductions.
+        Samples are processed block per block: all reductions of a block
+        run while it is still cache-resident, and Power is computed in a
+        small scratch buffer (no full Power samples array allocated).
+
+    Args:
+        vbat (numpy array): Vbat samples (in mV)
+        ishunt (numpy array): Ishunt samples (in mA)
+
+    Returns:
+        tuple: see _vip_stats_loop()
+
+    """
+    n = len(vbat)
+    scratch = np.empty(min(n, _BLOCK_SIZE), dtype=np.result_type(vbat, ishunt))
+    v_min = i_min = p_min = np.inf
+    v_max = i_max = p_max = -np.inf
+    # Accumulate sums in float64, as Numba kernel does
+    v_sum = i_sum = p_sum = 0.0
+    for start in range(0, n, _BLOCK_SIZE):
+        end = min(start + _BLOCK_SIZE, n)
+        v = vbat[start:end]
+        i = ishunt[start:end]
+        power = scratch[:end - start]
+        np.multiply(v, i, out=power)
+        v_min = min(v_min, v.min())
+        v_max = max(v_max, v.max())
+        v_sum += v.sum(dtype=np.float64)
+        i_min = min(i_min, i.min())
+        i_max = max(i_max, i.max())
+        i_sum += i.sum(dtype=np.float64)
+        p_min = min(p_min, power.min())
+        p_max = max(p_max, power.max())
+        p_sum += power.sum(dtype=np.float64)
+    return (v_min, v_max, v_sum / n,
+            i_min, i_max, i_sum / n,
+            p_min / 1000.0, p_max / 1000.0, p_sum / n / 1000.0)
+
+
+if njit is not None:
+    _vip_stats = njit(cache=True, fastmath=True, nogil=True)(_vip_stats_loop)
+else:
+    _vip_stats = _vip_stats_numpy
+
+
+def _raw_vip_stats_loop(vbat_raw, ishunt_raw):
+    """ Compute Vbat, Ishunt and Vbat * Ishunt raw samples statistics,
+        in a single loop over Vbat and Ishunt raw (int16) samples, using
+        integer arithmetic only (Numba kernel).
+        int16 * int16 products fit in int32, and sums are accumulated in
+        int64: results are exact.
+
+    Args:
+        vbat_raw (numpy int16 array): Vbat raw samples
+        ishunt_raw (numpy int16 array): Ishunt raw samples
+
+    Returns:
+        tuple: (Vbat min, Vbat max, Vbat sum,
+                Ishunt min, Ishunt max, Ishunt sum,
+                Vbat * Ishunt min, Vbat * Ishunt max, Vbat * Ishunt sum)
+               (raw values)
+
+    """
+    v_min = v_max = vbat_raw[0]
+    i_min = i_max = ishunt_raw[0]
+    p_min = p_max = np.int32(vbat_raw[0]) * np.int32(ishunt_raw[0])
+    v_sum = np.int64(0)
+    i_sum = np.int64(0)
+    p_sum = np.int64(0)
+    for j in range(vbat_raw.shape[0]):
+        v = vbat_raw[j]
+        i = ishunt_raw[j]
+        p = np.int32(v) * np.int32(i)
+        v_min = min(v_min, v)
+        v_max = max(v_max, v)
+        i_min = min(i_min, i)
+        i_max = max(i_max, i)
+        p_min = min(p_min, p)
+        p_max = max(p_max, p)
+        v_sum += v
+        i_sum += i
+        p_sum += p
+    return (v_min, v_max, v_sum,
+            i_min, i_max, i_sum,
+            p_min, p_max, p_sum)
+
+
+def _raw_vip_stats_numpy(vbat_raw, ishunt_raw):
+    """ Compute Vbat, Ishunt and Vbat * Ishunt raw samples statistics,
+        using numpy integer reductions, block per block.
+
+    Args:
+        vbat_raw (numpy int16 array): Vbat raw samples
+        ishunt_raw (numpy int16 array): Ishunt raw samples
+
+    Returns:
+        tuple: see _raw_vip_stats_loop()
+
+    """
+    n = len(vbat_raw)
+    scratch = np.empty(min(n, _BLOCK_SIZE), dtype=np.int32)
+    v_min = vbat_raw.min()
+    v_max = vbat_raw.max()
+    i_min = ishunt_raw.min()
+    i_max = ishunt_raw.max()
+    v_sum = i_sum = p_sum = 0
+    p_min = p_max = int(vbat_raw[0]) * int(ishunt_raw[0])
+    for start in range(0, n, _BLOCK_SIZE):
+        end = min(start + _BLOCK_SIZE, n)
+        v = vbat_raw[start:end]
+        i = ishunt_raw[start:end]
+        products = scratch[:end - start]
+        np.multiply(v, i, out=products, dtype=np.int32)
+        v_sum += int(v.sum(dtype=np.int64))
+        i_sum += int(i.sum(dtype=np.int64))
+        p_min = min(p_min, int(products.min()))
+        p_max = max(p_max, int(products.max()))
+        p_sum += int(products.sum(dtype=np.int64))
+    return (v_min, v_max, v_sum,
+            i_min, i_max, i_sum,
+            p_min, p_max, p_sum)
+
+
+if njit is not None:
+    _raw_vip_stats = njit(cache=True, nogil=True)(_raw_vip_stats_loop)
+else:
+    _raw_vip_stats = _raw_vip_stats_numpy
+
+
+def _scaled_stats(raw_min, raw_max, raw_sum, n, scale):
+    """ Scale raw samples statistics.
+
+    Args:
+        raw_min (int): raw samples min value
+        raw_max (int): raw samples max value
+        raw_sum (int): raw samples sum
+        n (int): samples count
+        scale (float): samples scale
+
+    Returns:
+        tuple: (min, max, average) of scaled samples
+
+    """
+    if scale < 0:
+        raw_min, raw_max = raw_max, raw_min
+    return (float(raw_min) * scale, float(raw_max) * scale,
+            float(raw_sum) * scale / n)
+
+
+def _power_loop(vbat, ishunt, power):
+    """ Compute Power samples (Vbat * Ishunt / 1000), in a single loop
+        over Vbat and Ishunt samples (Numba kernel).
+
+    Args:
+        vbat (numpy array): Vbat samples (in mV)
+        ishunt (numpy array): Ishunt samples (in mA)
+        power (numpy array): Power samples (in mW) (output)
+
+    Returns:
+        None
+
+    """
+    # Same float32 arithmetic as numpy
+    scale = np.float32(1000.0)
+    for j in range(vbat.shape[0]):
+        power[j] = vbat[j] * ishunt[j] / scale
+
+
+def _power_numpy(vbat, ishunt, power):
+    """ Compute Power samples (Vbat * Ishunt / 1000), using numpy
+        (in place, no temporary array).
+
+    Args:
+        vbat (numpy array): Vbat samples (in mV)
+        ishunt (numpy array): Ishunt samples (in mA)
+        power (numpy array): Power samples (in mW) (output)
+
+    Returns:
+        None
+
+    """
+    np.multiply(vbat, ishunt, out=power)
+    power /= 1000.0
+
+
+if njit is not None:
+    _power = njit(cache=True, nogil=True)(_power_loop)
+else:
+    _power = _power_numpy
+
+
+def _diff_stats_loop(values):
+    """ Compute statistics of the differences between consecutive values,
+        in a single loop (Numba kernel).
+
+    Args:
+        values (numpy array): values (at least 2)
+
+    Returns:
+        tuple: (min, max, average) difference
+
+    """
+    d_min = d_max = values[1] - values[0]
+    for j in range(2, values.shape[0]):
+        d = values[j] - values[j - 1]
+        d_min = min(d_min, d)
+        d_max = max(d_max, d)
+    # Sum of differences is last - first: no need to sum them
+    n = values.shape[0]
+    return d_min, d_max, (values[n - 1] - values[0]) / (n - 1)
+
+
+def _diff_stats_numpy(values):
+    """ Compute statistics of the differences between consecutive values,
+        using numpy.
+
+    Args:
+        values (numpy array): values (at least 2)
+
+    Returns:
+        tuple: see _diff_stats_loop()
+
+    """
+    diffs = np.subtract(values[1:], values[:-1])
+    # Sum of differences is last - first: no need to sum them
+    return (diffs.min(), diffs.max(),
+            float(values[-1] - values[0]) / (len(values) - 1))
+
+
+if njit is not None:
+    _diff_stats = njit(cache=True, nogil=True)(_diff_stats_loop)
+else:
+    _diff_stats = _diff_stats_numpy
+
+
+def power_samples(vbat, ishunt, out=None):
+    """ Compute Power samples (Vbat * Ishunt / 1000).
+
+    Args:
+        vbat (numpy array): Vbat samples (in mV)
+        ishunt (numpy array): Ishunt samples (in mA), same length as vbat
+        out (numpy array): optional buffer where to save Power samples,
+                           allocated if None
+
+    Returns:
+        numpy array: Power samples (in mW)
+
+    """
+    if out is None:
+        out = np.empty_like(vbat)
+    _power(vbat, ishunt, out)
+    return out
+
+
+def vip_stats(vbat, ishunt):
+    """ Compute Vbat, Ishunt and Power (Vbat * Ishunt / 1000) min, max and
+        average values.
+
+    Args:
+        vbat (numpy array): Vbat samples (in mV)
+        ishunt (numpy array): Ishunt samples (in mA), same length as vbat
+
+    Returns:
+        tuple: (Vbat min, Vbat max, Vbat avg,
+                Ishunt min, Ishunt max, Ishunt avg,
+                Power min, Power max, Power avg)
+               (Python floats), all NaN if there is no sample.
+
+    """
+    if len(vbat) == 0:
+        return (float('nan'),) * 9
+    # Return Python floats (not numpy scalars), cheaper to format
+    return tuple(map(float, _vip_stats(vbat, ishunt)))
+
+
+def raw_vip_stats(vbat_raw, vbat_scale, ishunt_raw, ishunt_scale):
+    """ Compute Vbat, Ishunt and Power (Vbat * Ishunt / 1000) min, max and
+        average values, from raw (int16) samples and their scale.
+        Much faster than vip_stats() on scaled samples (integer arithmetic
+        only), and no need to scale samples first.
+
+    Args:
+        vbat_raw (numpy int16 array): Vbat raw samples
+        vbat_scale (float): Vbat samples scale (mV)
+        ishunt_raw (numpy int16 array): Ishunt raw samples,
+                                        same length as vbat_raw
+        ishunt_scale (float): Ishunt samples scale (mA)
+
+    Returns:
+        tuple: see vip_stats()
+
+    """
+    n = len(vbat_raw)
+    if n == 0:
+        return (float('nan'),) * 9
+    return _scaled_vip_stats(_raw_vip_stats(vbat_raw, ishunt_raw), n,
+                             vbat_scale, ishunt_scale)
+
+
+def _scaled_vip_stats(raw_stats, n, vbat_scale, ishunt_scale):
+    """ Scale raw Vbat, Ishunt and Power statistics.
+
+    Args:
+        raw_stats (tuple): raw statistics, as returned by _raw_vip_stats()
+        n (int): samples count (> 0)
+        vbat_scale (float): Vbat samples scale (mV)
+        ishunt_scale (float): Ishunt samples scale (mA)
+
+    Returns:
+        tuple: see vip_stats()
+
+    """
+    (v_min, v_max, v_sum,
+     i_min, i_max, i_sum,
+     p_min, p_max, p_sum) = raw_stats
+    vbat_scale = float(vbat_scale)
+    ishunt_scale = float(ishunt_scale)
+    return (_scaled_stats(v_min, v_max, v_sum, n, vbat_scale) +
+            _scaled_stats(i_min, i_max, i_sum, n, ishunt_scale) +
+            _scaled_stats(p_min, p_max, p_sum, n,
+                          vbat_scale * ishunt_scale / 1000.0))
+
+
+class RawVIPStats(object):
+    """ Running Vbat, Ishunt and Power statistics of raw (int16) samples.
+
+    Update statistics chunk per chunk while samples are being captured,
+    instead of reducing all samples once capture is completed.
+    Exact integer arithmetic: same results as raw_vip_stats() on all
+    samples at once.
+
+    """
+    def __init__(self):
+        """ Initialise running statistics (no samples).
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+        self._raw_stats = None
+        self.count = 0
+
+    def update(self, vbat_raw, ishunt_raw):
+        """ Update statistics with a new chunk of raw samples.
+
+        Args:
+            vbat_raw (numpy int16 array): Vbat raw samples
+            ishunt_raw (numpy int16 array): Ishunt raw samples,
+                                            same length as vbat_raw
+
+        Returns:
+            None
+
+        """
+        if len(vbat_raw) == 0:
+            return
+        (v_min, v_max, v_sum,
+         i_min, i_max, i_sum,
+         p_min, p_max, p_sum) = _raw_vip_stats(vbat_raw, ishunt_raw)
+        if self._raw_stats is not None:
+            (prev_v_min, prev_v_max, prev_v_sum,
+             prev_i_min, prev_i_max, prev_i_sum,
+             prev_p_min, prev_p_max, prev_p_sum) = self._raw_stats
+            v_min = min(v_min, prev_v_min)
+            v_max = max(v_max, prev_v_max)
+            v_sum += prev_v_sum
+            i_min = min(i_min, prev_i_min)
+            i_max = max(i_max, prev_i_max)
+            i_sum += prev_i_sum
+            p_min = min(p_min, prev_p_min)
+            p_max = max(p_max, prev_p_max)
+            p_sum += prev_p_sum
+        self._raw_stats = (v_min, v_max, v_sum,
+                           i_min, i_max, i_sum,
+                           p_min, p_max, p_sum)
+        self.count += len(vbat_raw)
+
+    def get(self, vbat_scale, ishunt_scale):
+        """ Return scaled statistics of all samples seen so far.
+
+        Args:
+            vbat_scale (float): Vbat samples scale (mV)
+            ishunt_scale (float): Ishunt samples scale (mA)
+
+        Returns:
+            tuple: see vip_stats()
+
+        """
+        if self.count == 0:
+            return (float('nan'),) * 9
+        return _scaled_vip_stats(self._raw_stats, self.count,
+                                 vbat_scale, ishunt_scale)
+
+
+def diff_stats(values):
+    """ Compute min, max and average differences between consecutive values
+        (e.g. time between 2 consecutive samples), without allocating
+        the differences array.
+
+    Args:
+        values (numpy array): values (e.g. timestamps)
+
+    Returns:
+        tuple: (min, max, average) difference (Python floats).
+               All NaN if there are less than 2 values.
+
+    """
+    if len(values) < 2:
+        return (float('nan'),) * 3
+    return tuple(map(float, _diff_stats(values)))
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """ Baylibre's ACME Cape Abstraction class
 
 Baylibre's ACME Cape Abstraction class.
@@ -9,9 +9,11 @@ and the work done on "pyacmegraph" tool done by:
     - Sebastien Jan <sjan@baylibre.com>.
 """
 
-from __future__ import print_function
+import re
 import traceback
-import xmlrpclib
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+import xmlrpc.client
 import iio
 from mltrace import MLTrace
 from ping import ping
@@ -31,6 +33,27 @@ __version__ = "0.2"
 __deprecated__ = False
 
 
+# ACME XMLRPC service TCP port
+_ACME_XMLRPC_PORT = 8000
+# How long to wait for the ACME XMLRPC service to accept a connection (s)
+_IS_UP_TIMEOUT = 0.5
+# How long a successful/failed 'is_up' check remains valid (s)
+_IS_UP_CACHE_DURATION = 2.0
+# Max simultaneous ACME XMLRPC requests. The ACME XMLRPC service serves
+# requests one at a time, keep pending connections below its listen backlog (5)
+_XMLRPC_MAX_REQUESTS = 4
+
+# Probe details, as reported by the ACME XMLRPC 'info' service, e.g.:
+#   PowerProbe USB @slot 1 (1):
+#       RevB
+#       Has Power Switch
+#       R_Shunt: 10000 uOhm
+_PROBE_INFO_RE = re.compile(
+    r"(?P<type>JACK|USB|HE10)"
+    r"(?:.*?(?P<pwr_switch>Has Power Switch))?"
+    r".*?R_Shunt:\s*(?P<shunt>\d+)\s*uOhm", re.S)
+
+
 class IIOAcmeCape(object):
     """ Represent Baylibre's ACME cape.
 
@@ -53,9 +76,11 @@ class IIOAcmeCape(object):
         self._verbose_level = verbose_level
         self._trace = MLTrace(verbose_level, "ACME Cape")
         self._iioctx = None
-        self._slots = []
+        self._is_up_cache = None
         # Hard-coded value until exported by ACME FW via IIO or XMLRPC service
         self._slots_count = 8
+        # One entry per slot (None if slot not populated)
+        self._slots = [None] * self._slots_count
 
     def is_up(self):
         """ Check if the ACME cape is up and running.
@@ -67,7 +92,20 @@ class IIOAcmeCape(object):
             bool: True if ACME cape is operational, False otherwise.
 
         """
-        return ping(self._ip)
+        # Ping the ACME XMLRPC service port (instead of sending an ICMP
+        # ping): cheaper, and checks the service actually used to find probes.
+        # Result is cached for a short while, for repeated calls (timed with
+        # monotonic clock, not affected by system clock updates).
+        now = monotonic()
+        if self._is_up_cache is not None:
+            timestamp, is_up = self._is_up_cache
+            if now - timestamp < _IS_UP_CACHE_DURATION:
+                return is_up
+        is_up = ping(self._ip, _ACME_XMLRPC_PORT, _IS_UP_TIMEOUT)
+        if not is_up:
+            self._trace.trace(1, "ACME XMLRPC service unreachable!")
+        self._is_up_cache = (now, is_up)
+        return is_up
 
     def get_slot_count(self):
         """ Return the number of slots available on the cape.
@@ -79,9 +117,91 @@ class IIOAcmeCape(object):
             int: number of slots available on the cape (> 0).
 
         """
-        self._trace.trace(1, "Slot count: %u" % self._slots_count)
+        self._trace.trace(1, "Slot count: %u", self._slots_count)
         return self._slots_count
 
+    def _trace_exception(self):
+        """ Trace the exception being handled, for debug purposes.
+            Private function, not to be used outside of the module.
+            Formatting the traceback is costly, so only done when it is
+            actually going to be printed.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+        if self._verbose_level >= 2:
+            self._trace.trace(2, traceback.format_exc())
+
+    def _get_probe(self, slot):
+        """ Return the probe attached to selected slot.
+            Private function, not to be used outside of the module.
+
+        Args:
+            slot (int): ACME cape slot, as labelled on the cape (>0).
+
+        Returns:
+            IIOAcmeProbe: probe attached to selected slot,
+                          None if no probe attached.
+
+        """
+        # ACME slots are labelled from 1 to 8 on cape,
+        # but handled from 0 to 7 in SW.
+        if slot < 1 or slot > len(self._slots) or self._slots[slot - 1] is None:
+            self._trace.trace(1, "No probe in slot %d", slot)
+            return None
+        return self._slots[slot - 1]
+
+    def _get_slot_info(self, acme_server_address, slot):
+        """ Retrieve the XMLRPC info string of the selected slot.
+            Private function, not to be used outside of the module.
+            May be run in a worker thread, hence uses its own XMLRPC proxy
+            (proxies are not thread-safe).
+
+        Args:
+            acme_server_address (string): ACME XMLRPC server address
+            slot (int): ACME cape slot, as labelled on the cape (>0).
+
+        Returns:
+            string: slot info string, None in case of error.
+
+        """
+        try:
+            proxy = xmlrpc.client.ServerProxy("http://%s/acme" % acme_server_address)
+            return proxy.info("%s" % slot)
+        except Exception:
+            return None
+
+    def _create_probe(self, settings):
+        """ Create the IIOAcmeProbe instance of a given slot.
+            Private function, not to be used outside of the module.
+            May be run in a worker thread.
+
+        Args:
+            settings (tuple): probe settings, as (slot, probe_type, shunt,
+                              pwr_switch, iio_device), with:
+                slot (int): ACME cape slot, as labelled on the cape (>0).
+                probe_type (string): probe type ('JACK', 'USB', or 'HE10')
+                shunt (int): shunt resistor value (in micro-ohm)
+                pwr_switch (bool): True if the probe is equipped with a power
+                                   switch, False otherwise
+                iio_device (object): IIO device to use to control the probe
+
+        Returns:
+            IIOAcmeProbe: probe instance, None in case of error.
+
+        """
+        slot = settings[0]
+        try:
+            return IIOAcmeProbe(*settings, verbose_level=self._verbose_level)
+        except Exception:
+            self._trace.trace(1, "Failed to create slot %d probe!", slot)
+            self._trace_exception()
+            return None
+
     def _find_probes(self):
         """ Enumerate ACEM probes attached to the ACME cape,
             retrieving probe details.
@@ -94,74 +214,58 @@ class IIOAcmeCape(object):
             bool: True if operation is successful, False otherwise.
 
         """
-        acme_server_address = "%s:%d" % (self._ip, 8000)
-
-        # Use ACME XMLRPC service
-        try:
-            proxy = xmlrpclib.ServerProxy("http://%s/acme" % acme_server_address)
-        except:
-            self._trace.trace(1,
-                              "Failed to use ACME XMLRPC service! (\"" +
-                              acme_server_address + "\")")
-            self._trace.trace(2, traceback.format_exc())
-            return False
-        self._trace.trace(1, "ACME XMLRPC service ready.")
+        acme_server_address = "%s:%d" % (self._ip, _ACME_XMLRPC_PORT)
+
+        # Query ACME slots info (one XMLRPC request per slot). Requests are
+        # served one at a time by the ACME XMLRPC service: only a few are
+        # issued at once, overlapping client-side connection setup.
+        slots = range(1, self._slots_count + 1)
+        with ThreadPoolExecutor(max_workers=_XMLRPC_MAX_REQUESTS) as pool:
+            infos = list(pool.map(self._get_slot_info,
+                                  [acme_server_address] * len(slots), slots))
         # Browse ACME slots one by one to find which ones are populated
+        self._slots = [None] * self._slots_count
         iio_device_idx = 0
+        probes_settings = []
         for i in range(1, self._slots_count + 1):
-            try:
-                info = proxy.info("%s" % i)
-                self._trace.trace(2, info)
-            except:
-                self._trace.trace(1, "No XMLRPC service found for slot %d." % i)
+            info = infos[i - 1]
+            if info is None:
+                self._trace.trace(1, "No XMLRPC service found for slot %d.", i)
                 continue
+            self._trace.trace(2, info)
             if info.find('Failed') != -1:
                 # Slot no used
-                self._trace.trace(1, "XMLRPC: ACME Cape slot %d is empty." % i)
-                self._slots.append(None)
+                self._trace.trace(1, "XMLRPC: ACME Cape slot %d is empty.", i)
             else:
-                self._trace.trace(1, "XMLRPC: ACME Cape slot %d is used." % i)
-                # Retrieve probe type
-                if info.find("JACK") != -1:
-                    probe_type = "JACK"
-                elif info.find("USB") != -1:
-                    probe_type = "USB"
-                elif info.find("HE10") != -1:
-                    probe_type = "HE10"
-                else:
-                    self._trace.trace(1, "XMLRPC: probe type not found?!")
-                    self._slots.append(None)
+                self._trace.trace(1, "XMLRPC: ACME Cape slot %d is used.", i)
+                # Retrieve probe type, shunt resistor value
+                # and power switch capability
+                match = _PROBE_INFO_RE.search(info)
+                if match is None:
+                    self._trace.trace(1, "XMLRPC: probe type or shunt not found?!")
                     continue
+                probe_type = match.group('type')
+                shunt = match.group('shunt')
+                pwr_switch = match.group('pwr_switch') is not None
                 self._trace.trace(2, "Probe type: " + probe_type)
-
-                # Retrieve shunt resistor value
-                pos1 = info.find("R_Shunt:")
-                if pos1 != -1:
-                    pos2 = info.find("uOhm")
-                    if pos2 != -1:
-                        shunt = info[pos1 + 9: pos2 - 1]
-                        self._trace.trace(2, "Probe shunt: " + shunt)
-                    else:
-                        self._trace.trace(1, "XMLRPC: probe shunt not found?!")
-                        continue
-                else:
-                    self._trace.trace(1, "XMLRPC: probe shunt not found?!")
-                    continue
-
-                # Retrieve power switch capability
-                if info.find("Has Power Switch") != -1:
-                    pwr_switch = True
-                else:
-                    pwr_switch = False
+                self._trace.trace(2, "Probe shunt: " + shunt)
                 self._trace.trace(2, "Probe power switch: " + str(pwr_switch))
 
-                # Create IIOAcmeProbe instance
-                self._slots.append(IIOAcmeProbe(i, probe_type,
-                                                int(shunt), pwr_switch,
-                                                self._iioctx.devices[iio_device_idx],
-                                                self._verbose_level))
+                # Save IIOAcmeProbe instance settings (created below)
+                probes_settings.append((i, probe_type, int(shunt), pwr_switch,
+                                        self._iioctx.devices[iio_device_idx]))
                 iio_device_idx = iio_device_idx + 1
-        return True
+
+        if not probes_settings:
+            return True
+        # Create IIOAcmeProbe instances from a thread pool. IIO requests all
+        # go through the single IIO context connection (serialized by
+        # libiio), only probes local setup overlaps.
+        with ThreadPoolExecutor(max_workers=len(probes_settings)) as pool:
+            probes = list(pool.map(self._create_probe, probes_settings))
+        for settings, probe in zip(probes_settings, probes):
+            self._slots[settings[0] - 1] = probe
+        return None not in probes
 
     def _show_iio_context_attributes(self):
         """ Display IIO contect attributes, for debug purposes.
@@ -176,12 +280,16 @@ class IIOAcmeCape(object):
         """
         self._trace.trace(3, "======== IIO context infos ========")
         self._trace.trace(3, "  Name: " + self._iioctx.name)
-        self._trace.trace(3, "  Library version: %u.%u (git tag: %s)" % self._iioctx.version)
-        self._trace.trace(3, "  Backend version: %u.%u (git tag: %s)" % self._iioctx.version)
+        # Retrieve version and attributes only once (each access
+        # goes through libiio)
+        version = self._iioctx.version
+        self._trace.trace(3, "  Library version: %u.%u (git tag: %s)", *version)
+        self._trace.trace(3, "  Backend version: %u.%u (git tag: %s)", *version)
         self._trace.trace(3, "  Backend description string: " + self._iioctx.description)
-        if len(self._iioctx.attrs) > 0:
-            self._trace.trace(3, "  Attributes: %u" % len(self._iioctx.attrs))
-            for attr, value in self._iioctx.attrs.items():
+        attrs = list(self._iioctx.attrs.items())
+        if len(attrs) > 0:
+            self._trace.trace(3, "  Attributes: %u", len(attrs))
+            for attr, value in attrs:
                 self._trace.trace(3, "    " + attr + ": " + value)
         self._trace.trace(3, "===================================")
 
@@ -197,13 +305,13 @@ class IIOAcmeCape(object):
         """
         # Connecting to ACME
         try:
-            self._trace.trace(1, "Connecting to %s..." % self._ip)
+            self._trace.trace(1, "Connecting to %s...", self._ip)
             self._iioctx = iio.Context("ip:" + self._ip)
         except OSError:
             self._trace.trace(1, "Connection timed out!")
             return False
-        except:
-            self._trace.trace(2, traceback.format_exc())
+        except Exception:
+            self._trace_exception()
             return False
 
         if self._verbose_level >= 2:
@@ -213,12 +321,29 @@ class IIOAcmeCape(object):
         # ACME Cape slot the IIO device is attached. Hence, need to first find
         # the populated ACME Cape slot(s), and then save this info.
         try:
-            self._find_probes()
-        except:
-            self._trace.trace(2, traceback.format_exc())
+            return self._find_probes()
+        except Exception:
+            self._trace_exception()
             return False
 
-        return True
+    def deinit(self):
+        """ Release IIO resources: probes capture buffers first, then probes
+            and IIO context (buffers must not outlive the IIO context they
+            were created from).
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+        for probe in self._slots:
+            if probe is not None:
+                probe.release_capture_buffer()
+        self._slots = [None] * self._slots_count
+        self._iioctx = None
+        self._trace.trace(1, "IIO context released.")
 
     def probe_is_attached(self, slot):
         """ Return True if a probe is attached to selected slot, False otherwise.
@@ -230,18 +355,13 @@ class IIOAcmeCape(object):
             bool: True if a probe is attached to selected slot, False otherwise.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            if self._slots[slot - 1] is None:
-                self._trace.trace(1, "Slot %d not populated." % slot)
-                return False
-            self._trace.trace(1, "Slot %d populated." % slot)
-            return True
-        except:
-            self._trace.trace(1, "Failed to determine slot %d status!" % slot)
-            self._trace.trace(2, traceback.format_exc())
+        # ACME slots are labelled from 1 to 8 on cape,
+        # but handled from 0 to 7 in SW.
+        if slot < 1 or slot > len(self._slots) or self._slots[slot - 1] is None:
+            self._trace.trace(1, "Slot %d not populated.", slot)
             return False
+        self._trace.trace(1, "Slot %d populated.", slot)
+        return True
 
     def enable_capture_channel(self, slot, channel, enable):
         """ Enable/disable capture of selected channel.
@@ -255,16 +375,14 @@ class IIOAcmeCape(object):
             bool: True if operation is successful, False otherwise.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].enable_capture_channel(channel, enable)
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
+        probe = self._get_probe(slot)
+        if probe is None:
             return False
-        except:
-            self._trace.trace(1, "Failed to configure capture channel (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
+        try:
+            return probe.enable_capture_channel(channel, enable)
+        except Exception:
+            self._trace.trace(1, "Failed to configure capture channel (slot %d)!", slot)
+            self._trace_exception()
             return False
 
     def set_oversampling_ratio(self, slot, oversampling_ratio):
@@ -278,16 +396,14 @@ class IIOAcmeCape(object):
             bool: True if operation is successful, False otherwise.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].set_oversampling_ratio(oversampling_ratio)
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
+        probe = self._get_probe(slot)
+        if probe is None:
             return False
-        except:
-            self._trace.trace(1, "Failed to configure oversampling ratio (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
+        try:
+            return probe.set_oversampling_ratio(oversampling_ratio)
+        except Exception:
+            self._trace.trace(1, "Failed to configure oversampling ratio (slot %d)!", slot)
+            self._trace_exception()
             return False
 
     def enable_asynchronous_reads(self, slot, enable):
@@ -302,16 +418,14 @@ class IIOAcmeCape(object):
             bool: True if operation is successful, False otherwise.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].enable_asynchronous_reads(enable)
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
+        probe = self._get_probe(slot)
+        if probe is None:
             return False
-        except:
-            self._trace.trace(1, "Failed to configure asynchronous reads (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
+        try:
+            return probe.enable_asynchronous_reads(enable)
+        except Exception:
+            self._trace.trace(1, "Failed to configure asynchronous reads (slot %d)!", slot)
+            self._trace_exception()
             return False
 
     def get_sampling_frequency(self, slot):
@@ -325,16 +439,14 @@ class IIOAcmeCape(object):
                  Return 0 in case of error.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].get_sampling_frequency()
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
+        probe = self._get_probe(slot)
+        if probe is None:
             return False
-        except:
-            self._trace.trace(1, "Failed to retrieve sampling frequency (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
+        try:
+            return probe.get_sampling_frequency()
+        except Exception:
+            self._trace.trace(1, "Failed to retrieve sampling frequency (slot %d)!", slot)
+            self._trace_exception()
             return False
 
     def get_shunt(self, slot):
@@ -348,16 +460,14 @@ class IIOAcmeCape(object):
                  False otherwise.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].get_shunt()
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
+        probe = self._get_probe(slot)
+        if probe is None:
             return False
-        except:
-            self._trace.trace(1, "Failed to retrieve shunt value (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
+        try:
+            return probe.get_shunt()
+        except Exception:
+            self._trace.trace(1, "Failed to retrieve shunt value (slot %d)!", slot)
+            self._trace_exception()
             return False
 
     def allocate_capture_buffer(self, slot, samples_count, cyclic=False):
@@ -373,16 +483,14 @@ class IIOAcmeCape(object):
             bool: True if operation is successful, False otherwise.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].allocate_capture_buffer(samples_count, cyclic)
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
+        probe = self._get_probe(slot)
+        if probe is None:
             return False
-        except:
-            self._trace.trace(1, "Failed to allocate capture buffer (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
+        try:
+            return probe.allocate_capture_buffer(samples_count, cyclic)
+        except Exception:
+            self._trace.trace(1, "Failed to allocate capture buffer (slot %d)!", slot)
+            self._trace_exception()
             return False
 
     def refill_capture_buffer(self, slot):
@@ -395,41 +503,70 @@ class IIOAcmeCape(object):
             bool: True if operation is successful, False otherwise.
 
         """
-        try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].refill_capture_buffer()
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
+        probe = self._get_probe(slot)
+        if probe is None:
             return False
-        except:
-            self._trace.trace(1, "Failed to refill capture buffer (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
+        try:
+            return probe.refill_capture_buffer()
+        except Exception:
+            self._trace.trace(1, "Failed to refill capture buffer (slot %d)!", slot)
+            self._trace_exception()
             return False
 
-    def read_capture_buffer(self, slot, channel):
+    def read_capture_buffer(self, slot, channel, raw=False):
         """ Return the samples stored in the capture buffer of selected channel.
-            Take care of data scaling too.
+            Take care of data scaling too, unless raw samples are requested.
 
         Args:
             slot (int): ACME cape slot, as labelled on the cape (>0)
             channel (string): capture channel
+            raw (bool): True to return raw (unscaled) samples and their
+                        scale, False to return scaled samples.
 
         Returns:
             dict: a dictionary holding the scaled data, with the following keys:
                   "channel" (string): channel,
-                  "unit" (string): data unit,
-                  "samples" (int or float): scaled samples.
+                  "unit" (string): data unit (of scaled samples),
+                  "samples" (int64 or float32 array): scaled samples,
+                      or raw samples (int64 or int16 array) if 'raw' is True,
+                  "scale" (float): samples scale (only if 'raw' is True).
+                  None in case of error.
+            Note "samples" is a view on an internal buffer, overwritten by
+            the next read: copy it if it needs to be kept.
 
         """
+        probe = self._get_probe(slot)
+        if probe is None:
+            return None
         try:
-            # ACME slots are labelled from 1 to 8 on cape,
-            # but handled from 0 to 7 in SW.
-            return self._slots[slot - 1].read_capture_buffer(channel)
-        except AttributeError:
-            self._trace.trace(1, "No probe in slot %d" % slot)
-            return False
-        except:
-            self._trace.trace(1, "Failed to read capture buffer (slot %d)!" % slot)
-            self._trace.trace(2, traceback.format_exc())
-            return False
+            return probe.read_capture_buffer(channel, raw)
+        except Exception:
+            self._trace.trace(1, "Failed to read capture buffer (slot %d)!", slot)
+            self._trace_exception()
+            return None
+
+    def read_capture_buffers(self, slot, channels, raw=False):
+        """ Return the samples stored in the capture buffer of selected
+            channels, all at once. Take care of data scaling too, unless
+            raw samples are requested.
+
+        Args:
+            slot (int): ACME cape slot, as labelled on the cape (>0)
+            channels (list of strings): capture channels
+            raw (bool): see read_capture_buffer()
+
+        Returns:
+            dict: a dictionary holding the scaled data of each channel
+                  (channel as key, value as returned by
+                  read_capture_buffer()), None in case of error.
+
+        """
+        probe = self._get_probe(slot)
+        if probe is None:
+            return None
+        try:
+            return probe.read_capture_buffers(channels, raw)
+        except Exception:
+            self._trace.trace(1, "Failed to read capture buffers (slot %d)!", slot)
+            self._trace_exception()
+            return None
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """ Baylibre's ACME Probe Abstraction class.
 
 Baylibre's ACME Probe Abstraction class.
@@ -10,8 +10,6 @@ and the work done on "pyacmegraph" tool done by:
 """
 
 
-from __future__ import print_function
-import struct
 import traceback
 import numpy as np
 import iio
@@ -40,6 +38,7 @@ CHANNEL_DICT = {
     'Power' : 'power2'}
 
 # Channels unit
+# (scaled samples are float32, except 'Time' samples which are int64)
 CHANNEL_UNITS = {
     'Vshunt' : 'mV',
     'Vbat' : 'mV',
@@ -79,6 +78,25 @@ class IIOAcmeProbe(object):
         self._pwr_switch = pwr_switch
         self._iio_device = iio_device
         self._iio_buffer = None
+        # Settings the IIO buffer was allocated with (reused if unchanged)
+        self._iio_buffer_settings = None
+        self._enabled_channels = set()
+        self._out_buffers = {}
+        self._sampling_frequency = None
+        self._verbose_level = verbose_level
+        # Resolve IIO channels (and their scale) once and for all,
+        # rather than on every channel configuration / buffer read.
+        self._iio_channels = {}
+        self._scales = {}
+        for channel, iio_ch_id in CHANNEL_DICT.items():
+            try:
+                iio_ch = self._iio_device.find_channel(iio_ch_id)
+                self._iio_channels[channel] = iio_ch
+                if iio_ch is not None and iio_ch_id != 'timestamp':
+                    self._scales[channel] = np.float32(
+                        float(iio_ch.attrs['scale'].value))
+            except:
+                self._iio_channels.setdefault(channel, None)
         self._trace = MLTrace(
             verbose_level, "Probe " + self._type + " Slot " + str(self._slot))
 
@@ -100,41 +118,44 @@ class IIOAcmeProbe(object):
             None
 
         """
+        if self._verbose_level < 3:
+            return
         self._trace.trace(3, "======== IIO Device infos ========")
         self._trace.trace(3, "  ID: " +  self._iio_device.id)
         self._trace.trace(3, "  Name: " +  self._iio_device.name)
         if  self._iio_device is iio.Trigger:
             self._trace.trace(
-                3, "  Trigger: yes (rate: %u Hz)" %  self._iio_device.frequency)
+                3, "  Trigger: yes (rate: %u Hz)", self._iio_device.frequency)
         else:
             self._trace.trace(3, "  Trigger: none")
+        # Walk attributes dictionaries only once (each access may end up
+        # being a request to the remote IIO daemon)
+        attrs = list(self._iio_device.attrs.items())
+        self._trace.trace(3, "  Device attributes found: %u", len(attrs))
+        for name, attr in attrs:
+            self._trace.trace(3, "    " + name + ": " + attr.value)
+        debug_attrs = list(self._iio_device.debug_attrs.items())
         self._trace.trace(
-            3, "  Device attributes found: %u" % len(self._iio_device.attrs))
-        for attr in  self._iio_device.attrs:
-            self._trace.trace(
-                3, "    " + attr + ": " +  self._iio_device.attrs[attr].value)
-        self._trace.trace(3, "  Device debug attributes found: %u" % len(
-            self._iio_device.debug_attrs))
-        for attr in  self._iio_device.debug_attrs:
-            self._trace.trace(
-                3, "    " + attr + ": " +  self._iio_device.debug_attrs[attr].value)
-        self._trace.trace(3, "  Device channels found: %u" % len(
-            self._iio_device.channels))
-        for chn in  self._iio_device.channels:
-            self._trace.trace(3, "    Channel ID: %s" % chn.id)
+            3, "  Device debug attributes found: %u", len(debug_attrs))
+        for name, attr in debug_attrs:
+            self._trace.trace(3, "    " + name + ": " + attr.value)
+        channels = self._iio_device.channels
+        self._trace.trace(3, "  Device channels found: %u", len(channels))
+        for chn in channels:
+            self._trace.trace(3, "    Channel ID: %s", chn.id)
             if chn.name is None:
                 self._trace.trace(3, "    Channel name: (none)")
             else:
-                self._trace.trace(3, "    Channel name: %s" % chn.name)
-            self._trace.trace(3, "    Channel direction: %s" % (
-                "output" if chn.output else 'input'))
+                self._trace.trace(3, "    Channel name: %s", chn.name)
+            self._trace.trace(3, "    Channel direction: %s",
+                              "output" if chn.output else 'input')
+            chn_attrs = list(chn.attrs.items())
             self._trace.trace(
-                3, "    Channel attributes found: %u" % len(chn.attrs))
-            for attr in chn.attrs:
-                self._trace.trace(
-                    3, "      " + attr + ": " + chn.attrs[attr].value)
+                3, "    Channel attributes found: %u", len(chn_attrs))
+            for name, attr in chn_attrs:
+                self._trace.trace(3, "      " + name + ": " + attr.value)
             self._trace.trace(3, "")
-        self._trace.trace(2, "==================================")
+        self._trace.trace(3, "==================================")
 
     def get_slot(self):
         """ Return the slot number (int) in which the probe is attached.
@@ -225,12 +246,14 @@ class IIOAcmeProbe(object):
         try:
             self._iio_device.attrs["in_oversampling_ratio"].value = str(
                 oversampling_ratio)
-            self._trace.trace(1, "Oversampling ratio configured to %u." % (
-                oversampling_ratio))
+            self._trace.trace(1, "Oversampling ratio configured to %u.",
+                              oversampling_ratio)
+            # Sampling frequency depends on oversampling ratio
+            self._sampling_frequency = None
             return True
         except:
             self._trace.trace(1,
-                              "Failed to configure oversampling ratio (%u)!" %
+                              "Failed to configure oversampling ratio (%u)!",
                               oversampling_ratio)
             self._trace.trace(2, traceback.format_exc())
             return False
@@ -270,10 +293,15 @@ class IIOAcmeProbe(object):
                  Return 0 in case of error.
 
         """
+        # Sampling frequency only changes with the oversampling ratio,
+        # no need to read it again from the device until then.
+        if self._sampling_frequency is not None:
+            return self._sampling_frequency
         try:
             freq = self._iio_device.attrs['in_sampling_frequency'].value
-            self._trace.trace(1, "Sampling frequency: %sHz" % freq)
-            return int(freq)
+            self._trace.trace(1, "Sampling frequency: %sHz", freq)
+            self._sampling_frequency = int(freq)
+            return self._sampling_frequency
         except:
             self._trace.trace(1, "Failed to retrieve sampling frequency!")
             self._trace.trace(2, traceback.format_exc())
@@ -281,6 +309,8 @@ class IIOAcmeProbe(object):
 
     def allocate_capture_buffer(self, samples_count, cyclic=False):
         """ Allocate buffer to store captured data.
+            The buffer already allocated is reused if settings (size,
+            cyclic, enabled channels) did not change.
 
         Args:
             samples_count (int): amount of samples to hold in buffer (> 0).
@@ -291,16 +321,51 @@ class IIOAcmeProbe(object):
             bool: True if operation is successful, False otherwise.
 
         """
+        settings = (samples_count, cyclic, frozenset(self._enabled_channels))
+        if self._iio_buffer is not None and settings == self._iio_buffer_settings:
+            self._trace.trace(1, "Buffer (count=%d, cyclic=%s) reused.",
+                              samples_count, cyclic)
+            return True
+        # Release previous buffer first (only one buffer per IIO device)
+        self._iio_buffer = None
+        self._iio_buffer_settings = None
         self._iio_buffer = iio.Buffer(self._iio_device, samples_count, cyclic)
         if self._iio_buffer != None:
-            self._trace.trace(1, "Buffer (count=%d, cyclic=%s) allocated." % (
-                samples_count, cyclic))
+            self._iio_buffer_settings = settings
+            # Preallocate the output (scaled samples) buffers once,
+            # these are reused by every read_capture_buffer() call
+            # (and by next allocations, if large enough)
+            for channel in self._iio_channels:
+                if CHANNEL_DICT[channel] != 'timestamp':
+                    dtype = np.float32
+                else:
+                    dtype = np.int64
+                out_buffer = self._out_buffers.get(channel)
+                if out_buffer is None or len(out_buffer) < samples_count:
+                    self._out_buffers[channel] = np.empty(samples_count,
+                                                          dtype=dtype)
+            self._trace.trace(1, "Buffer (count=%d, cyclic=%s) allocated.",
+                              samples_count, cyclic)
             return True
         self._trace.trace(1,
-                          "Failed to allocate buffer! (count=%d, cyclic=%s)" % (
-                              samples_count, cyclic))
+                          "Failed to allocate buffer! (count=%d, cyclic=%s)",
+                          samples_count, cyclic)
         return False
 
+    def release_capture_buffer(self):
+        """ Release the capture buffer (if allocated).
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+        self._iio_buffer = None
+        self._iio_buffer_settings = None
+        self._trace.trace(1, "Buffer released.")
+
     def enable_capture_channel(self, channel, enable):
         """ Enable/disable capture of selected channel.
 
@@ -312,29 +377,32 @@ class IIOAcmeProbe(object):
             bool: True if operation is successful, False otherwise.
 
         """
+        cid = CHANNEL_DICT.get(channel)
         try:
-            iio_ch = self._iio_device.find_channel(CHANNEL_DICT[channel])
+            iio_ch = self._iio_channels[channel]
             if not iio_ch:
-                self._trace.trace(1, "Channel %s (%s) not found!" % (
-                    channel, CHANNEL_DICT[channel]))
+                self._trace.trace(1, "Channel %s (%s) not found!", channel, cid)
                 return False
-            self._trace.trace(2, "Channel %s (%s) found." % (
-                channel, CHANNEL_DICT[channel]))
+            self._trace.trace(2, "Channel %s (%s) found.", channel, cid)
             if enable is True:
                 iio_ch.enabled = True
-                self._trace.trace(1, "Channel %s (%s) capture enabled." % (
-                    channel, CHANNEL_DICT[channel]))
+                self._enabled_channels.add(channel)
+                self._trace.trace(1, "Channel %s (%s) capture enabled.",
+                                  channel, cid)
             else:
                 iio_ch.enabled = False
-                self._trace.trace(1, "Channel %s (%s) capture disabled." % (
-                    channel, CHANNEL_DICT[channel]))
+                self._enabled_channels.discard(channel)
+                self._trace.trace(1, "Channel %s (%s) capture disabled.",
+                                  channel, cid)
         except:
             if enable is True:
                 self._trace.trace(1,
-                                  "Failed to enable capture on channel %s (%s)!")
+                                  "Failed to enable capture on channel %s (%s)!",
+                                  channel, cid)
             else:
                 self._trace.trace(1,
-                                  "Failed to disable capture on channel %s (%s)!")
+                                  "Failed to disable capture on channel %s (%s)!",
+                                  channel, cid)
             self._trace.trace(2, traceback.format_exc())
             return False
         return True
@@ -358,54 +426,97 @@ class IIOAcmeProbe(object):
         self._trace.trace(1, "Buffer refilled.")
         return True
 
-    def read_capture_buffer(self, channel):
+    def read_capture_buffer(self, channel, raw=False):
         """ Return the samples stored in the capture buffer of selected channel.
-            Take care of data scaling too.
+            Take care of data scaling too, unless raw samples are requested.
 
         Args:
             channel (string): capture channel
+            raw (bool): True to return raw (unscaled) samples and their
+                        scale, False to return scaled samples.
 
         Returns:
             dict: a dictionary holding the scaled data, with the following keys:
                   "channel" (string): channel,
-                  "unit" (string): data unit,
-                  "samples" (int or float): scaled samples.
+                  "unit" (string): data unit (of scaled samples),
+                  "samples" (int64 or float32 array): scaled samples,
+                      or raw samples (int64 or int16 array) if 'raw' is True,
+                  "scale" (float): samples scale (only if 'raw' is True).
+            Note "samples" is a view on an internal buffer, overwritten by
+            the next read: copy it if it needs to be kept.
 
         """
         try:
             # Retrieve channel
-            iio_ch = self._iio_device.find_channel(CHANNEL_DICT[channel])
+            cid = CHANNEL_DICT[channel]
+            unit = CHANNEL_UNITS[channel]
+            iio_ch = self._iio_channels[channel]
             # Retrieve samples (raw)
             ch_buf_raw = iio_ch.read(self._iio_buffer)
-            if CHANNEL_DICT[channel] != 'timestamp':
+            if cid != 'timestamp':
                 # Retrieve channel scale
-                scale = float(iio_ch.attrs['scale'].value)
-                # Configure binary data format to unpack (16-bit signed integer)
-                unpack_str = 'h' * (len(ch_buf_raw) / struct.calcsize('h'))
+                scale = self._scales[channel]
+                # Binary data format: 16-bit signed integer
+                dtype = np.int16
             else:
                 # No scale attribute on 'timestamp' channel
                 scale = 1.0
-                # Configure binary data format to unpack (64-bit signed integer)
-                unpack_str = 'q' * (len(ch_buf_raw) / struct.calcsize('q'))
-            # Unpack data
-            values = struct.unpack(unpack_str, ch_buf_raw)
+                # Binary data format: 64-bit signed integer
+                dtype = np.int64
+            # Unpack data (read-only view on the raw buffer, no copy)
+            values = np.frombuffer(ch_buf_raw, dtype=dtype)
             self._trace.trace(
-                2, "Channel %s: %u samples read." % (channel, len(values)))
-            self._trace.trace(
-                3, "Channel %s samples       : %s" % (channel, str(values)))
-            # Scale values
-            self._trace.trace(3, "Scale: %f" % scale)
+                2, "Channel %s: %u samples read.", channel, len(values))
+            # Formatting numpy arrays is costly, do it only if printed
+            debug_trace = self._verbose_level >= 3
+            if debug_trace:
+                self._trace.trace(
+                    3, "Channel %s samples       : %s", channel, values)
+                self._trace.trace(3, "Scale: %f", scale)
+            if raw:
+                return {"channel": channel,
+                        "unit": unit,
+                        "samples": values,
+                        "scale": scale}
+            # Scale values (into the preallocated output buffer)
+            scaled_values = self._out_buffers[channel][:len(values)]
             if scale != 1.0:
-                scaled_values = np.asarray(values) * scale
+                # Fused int16 -> float32 cast and scaling (single pass,
+                # no float64 temporary)
+                np.multiply(values, scale, out=scaled_values)
             else:
-                scaled_values = np.asarray(values)
-            self._trace.trace(
-                3,
-                "Channel %s scaled samples: %s" % (channel, str(scaled_values)))
+                np.copyto(scaled_values, values)
+            if debug_trace:
+                self._trace.trace(
+                    3,
+                    "Channel %s scaled samples: %s", channel, scaled_values)
         except:
-            self._trace.trace(1, "Failed to read channel %s buffer!" % channel)
+            self._trace.trace(1, "Failed to read channel %s buffer!", channel)
             self._trace.trace(2, traceback.format_exc())
             return None
         return {"channel": channel,
-                "unit": CHANNEL_UNITS[channel],
+                "unit": unit,
                 "samples": scaled_values}
+
+    def read_capture_buffers(self, channels, raw=False):
+        """ Return the samples stored in the capture buffer of selected
+            channels, all at once. Take care of data scaling too, unless
+            raw samples are requested.
+
+        Args:
+            channels (list of strings): capture channels
+            raw (bool): see read_capture_buffer()
+
+        Returns:
+            dict: a dictionary holding the scaled data of each channel
+                  (channel as key, value as returned by
+                  read_capture_buffer()), None in case of error.
+
+        """
+        buffers = {}
+        for channel in channels:
+            buff = self.read_capture_buffer(channel, raw)
+            if buff is None:
+                return None
+            buffers[channel] = buff
+        return buffers
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """ Baylibre's ACME Cape Simulation class.
 
 Simulate Baylibre's ACME Cape, for debug purposes only.
@@ -10,8 +10,8 @@ Todo:
 
 """
 
-from __future__ import print_function
 from time import sleep
+import numpy as np
 from mltrace import MLTrace
 
 
@@ -43,13 +43,15 @@ class IIOFakeAcmeCape(object):
     This class is used to abstract and simulate Baylibre's ACME cape.
 
     """
-    def __init__(self, ip, verbose_level):
+    def __init__(self, ip, verbose_level, refill_latency=0.0):
         """ Initialise IIOAcmeCape module.
 
         Args:
             ip (string): network IP address of the ACME cape. May be either
             of format '192.168.1.2' or 'baylibre-acme.local'.
             verbose_level (int): how much verbose the debug trace shall be.
+            refill_latency (float): simulated capture buffer refill duration
+                                    (in seconds, 0 to not wait at all).
 
         Returns:
             None
@@ -62,6 +64,9 @@ class IIOFakeAcmeCape(object):
         self._channels = []
         self._samples_count = 0
         self._time_start = 0
+        self._refill_latency = refill_latency
+        # Constant samples buffers ((slot, channel, raw) as key)
+        self._constant_buffers = {}
 
     def is_up(self):
         """ Check if the ACME cape is up and running.
@@ -85,7 +90,7 @@ class IIOFakeAcmeCape(object):
             int: number of slots available on the cape (> 0).
 
         """
-        self._trace.trace(1, "Slot count: %u" % self._slots_count)
+        self._trace.trace(1, "Slot count: %u", self._slots_count)
         return self._slots_count
 
     def _find_probes(self):
@@ -114,6 +119,18 @@ class IIOFakeAcmeCape(object):
         """
         return True
 
+    def deinit(self):
+        """ Release IIO resources.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+        pass
+
     def probe_is_attached(self, slot):
         """ Return True if a probe is attached to selected slot, False otherwise.
 
@@ -124,7 +141,7 @@ class IIOFakeAcmeCape(object):
             bool: True if a probe is attached to selected slot, False otherwise.
 
         """
-        self._trace.trace(1, "Slot %d populated." % slot)
+        self._trace.trace(1, "Slot %d populated.", slot)
         return True
 
     def enable_capture_channel(self, slot, channel, enable):
@@ -145,7 +162,7 @@ class IIOFakeAcmeCape(object):
             if channel in self._channels:
                 self._channels.remove(channel)
         self._trace.trace(
-            1, "Slot %d enabled channels: %s" % (slot, self._channels))
+            1, "Slot %d enabled channels: %s", slot, self._channels)
         return True
 
     def set_oversampling_ratio(self, slot, oversampling_ratio):
@@ -227,38 +244,74 @@ class IIOFakeAcmeCape(object):
             bool: True if operation is successful, False otherwise.
 
         """
-        sleep(0.5)
+        if self._refill_latency:
+            sleep(self._refill_latency)
         return True
 
-    def read_capture_buffer(self, slot, channel):
+    def read_capture_buffer(self, slot, channel, raw=False):
         """ Return the samples stored in the capture buffer of selected channel.
-            Take care of data scaling too.
+            Take care of data scaling too, unless raw samples are requested.
 
         Args:
             slot (int): ACME cape slot, as labelled on the cape (>0)
             channel (string): capture channel
+            raw (bool): True to return raw (unscaled) samples and their
+                        scale, False to return scaled samples.
 
         Returns:
             dict: a dictionary holding the scaled data, with the following keys:
                   "channel" (string): channel,
-                  "unit" (string): data unit,
-                  "samples" (int or float): scaled samples.
+                  "unit" (string): data unit (of scaled samples),
+                  "samples" (int64 or float32 array): scaled samples,
+                      or raw samples (int64 or int16 array) if 'raw' is True,
+                  "scale" (float): samples scale (only if 'raw' is True).
 
         """
         if channel == "Time":
             buff = {"channel": channel,
                     "unit": CHANNEL_UNITS[channel],
-                    "samples": range(self._time_start,
-                                     self._time_start +
-                                     (1000000 * self._samples_count),
-                                     1000000)}
+                    "samples": np.arange(self._time_start,
+                                         self._time_start +
+                                         (1000000 * self._samples_count),
+                                         1000000, dtype=np.int64)}
             self._time_start += 1000000 * self._samples_count
-        elif channel == "Vbat":
-            buff = {"channel": channel,
-                    "unit": CHANNEL_UNITS[channel],
-                    "samples": [1000 * float(slot)] * self._samples_count}
         else:
+            # Samples are constant: build buffer once and return it again
+            # on next reads (not to be modified by caller)
+            # Fake raw samples are the scaled ones (scale = 1.0)
+            dtype = np.int16 if raw else np.float32
+            samples = self._constant_buffers.get((slot, channel, raw))
+            if samples is None or len(samples) != self._samples_count:
+                if channel == "Vbat":
+                    value = 1000 * slot
+                else:
+                    value = slot
+                samples = np.full(self._samples_count, value, dtype=dtype)
+                self._constant_buffers[(slot, channel, raw)] = samples
             buff = {"channel": channel,
                     "unit": CHANNEL_UNITS[channel],
-                    "samples": [float(slot)] * self._samples_count}
+                    "samples": samples}
+        if raw:
+            buff["scale"] = 1.0
         return buff
+
+    def read_capture_buffers(self, slot, channels, raw=False):
+        """ Return the samples stored in the capture buffer of selected
+            channels, all at once. Take care of data scaling too, unless
+            raw samples are requested.
+
+        Args:
+            slot (int): ACME cape slot, as labelled on the cape (>0)
+            channels (list of strings): capture channels
+            raw (bool): see read_capture_buffer()
+
+        Returns:
+            dict: a dictionary holding the scaled data of each channel
+                  (channel as key, value as returned by
+                  read_capture_buffer()), None in case of error.
+
+        """
+        buffers = {}
+        for channel in channels:
+            buffers[channel] = self.read_capture_buffer(slot, channel, raw)
+        return buffers
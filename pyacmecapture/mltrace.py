@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """ Multi-Level Trace Python Class
 
 Implement a smart trace with configurable header and debug trace levels.
@@ -15,7 +15,7 @@ __email__ =  "ptitiano@baylibre.com"
 __contact__ = "ptitiano@baylibre.com"
 __maintainer__ = "Patrick Titiano"
 __status__ = "Development"
-__version__ = "0.1"
+__version__ = "0.2"
 __deprecated__ = False
 
 
@@ -32,17 +32,22 @@ class MLTrace():
         self._verbose_level = verbose_level
         self._msg_header = msg_header
 
-    def trace(self, level, msg):
+    def trace(self, level, msg, *args):
         """Print debug messages depending on selected debug level.
 
         If 'level' <= self.verbose_level, then 'msg' is printed, ignored otherwise.
+        If 'args' are given, 'msg' is a format string, formatted with 'args'
+        ('msg' % args) only if the message is printed.
 
         Args:
             level: selected debug level (e.g. 1, 2, 3, ...)
             msg: a custom message (e.g. 'this is my great custom message')
+            args: optional 'msg' format arguments
         """
         if (self._verbose_level >= level):
+            if args:
+                msg = msg % args
             if self._msg_header != None:
                 print("[" + self._msg_header + "] " + msg)
             else:
-                print(msg)
\ No newline at end of file
+                print(msg)
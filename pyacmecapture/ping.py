@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """ Python Network Ping Utility
 
 Python function implementing network ping functionality.
@@ -7,8 +7,9 @@ Source: https://stackoverflow.com/questions/2953462/pinging-servers-in-python
 """
 
 
+import socket
+import subprocess
 from platform import system as system_name # Returns the system/OS name
-from os import system as system_call       # Execute a shell command
 
 __app_name__ = "Ping"
 __license__ = "MIT"
@@ -19,27 +20,66 @@ __email__ = "ptitiano@baylibre.com"
 __contact__ = "ptitiano@baylibre.com"
 __maintainer__ = "Patrick Titiano"
 __status__ = "Development"
-__version__ = "0.2"
+__version__ = "0.3"
 __deprecated__ = False
 
 
-def ping(host):
+# Ping parameters as function of OS
+_PING_PARAMS = ["-n", "1"] if system_name().lower() == "windows" else ["-c", "1"]
+
+# Cache of resolved host names (host name as key, IP address as value)
+_resolved_hosts = {}
+
+
+def resolve(host):
+    """Return the IP address of host (str), resolving it only once.
+
+    Args:
+        host: hostname (e.g. 192.168.1.2 or myhost.mydomain)
+
+    Returns:
+        str: IP address of host. Raise socket.error if host cannot be resolved.
+    """
+    address = _resolved_hosts.get(host)
+    if address is None:
+        address = socket.gethostbyname(host)
+        _resolved_hosts[host] = address
+    return address
+
+
+def ping(host, port=None, timeout=0.5):
     """Return True if host (str) responds to a ping request.
 
-    Send a ping request to 'host' and return True if a response is received,
-    False otherwise.
+    If 'port' is given, try to open a TCP connection to 'host':'port' and
+    return True if the connection is accepted, False otherwise. This is much
+    cheaper than running the system 'ping' command (no process creation),
+    and checks that the service running on 'port' is actually reachable.
+    Otherwise, send an ICMP ping request to 'host' (using the system 'ping'
+    command) and return True if a response is received, False otherwise.
     Remember that some hosts may not respond to a ping request even if the host
     name is valid.
 
     Args:
         host: hostname (e.g. 192.168.1.2 or myhost.mydomain)
+        port: TCP port to connect to (None to send an ICMP ping request)
+        timeout: TCP connection timeout (in seconds)
 
     Returns:
         True if host (str) responds to a ping request, False otherwise.
     """
+    if port is not None:
+        try:
+            sock = socket.create_connection((resolve(host), port), timeout)
+            sock.close()
+            return True
+        except (socket.error, socket.timeout):
+            return False
 
-    # Ping parameters as function of OS
-    parameters = "-n 1" if system_name().lower() == "windows" else "-c 1"
-
-    # Pinging
-    return system_call("ping " + parameters + " " + host + " > /dev/null") == 0
+    # Pinging (no shell involved)
+    try:
+        return subprocess.call(["ping"] + _PING_PARAMS + [host],
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL) == 0
+    except OSError:
+        # No 'ping' command
+        return False
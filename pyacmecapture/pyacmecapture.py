@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """ Python ACME Power Capture Utility
 
 This utility is designed to capture voltage, current and power samples with
@@ -19,25 +19,24 @@ and the work done on "pyacmegraph" tool done by:
 Leveraged IIOAcmeCape and IIOAcmeProbe classes abstracting IIO/ACME details.
 
 Todo:
-    * Fix Segmentation fault at end of script
     * Find a way to remove hard-coded power unit (uW)
 
 """
 
 
-from __future__ import print_function
 import traceback
 import sys
 import os
-from time import time, sleep
+from time import sleep, monotonic_ns, localtime, strftime
 import signal
 import logging
 import argparse
 import threading
-from time import time, localtime, strftime
+from concurrent.futures import ThreadPoolExecutor
 from colorama import init, Fore, Style
 import numpy as np
 from mltrace import MLTrace
+from acmestats import power_samples, vip_stats, raw_vip_stats, diff_stats, RawVIPStats
 from iioacmecape import IIOAcmeCape
 from iiofakeacmecape import IIOFakeAcmeCape
 
@@ -56,10 +55,21 @@ __deprecated__ = False
 
 _OVERSAMPLING_RATIO = 1
 _ASYNCHRONOUS_READS = False
+# Refill next capture buffer while processing samples of current one
+_OVERLAPPED_REFILLS = True
 _CAPTURED_CHANNELS = ["Time", "Vbat", "Ishunt"]
+# Simulated buffer refill duration of the fake cape (in seconds)
+_FAKE_REFILL_LATENCY = 0.5
 _REPORT_1ST_COL_WIDTH = 13
 _REPORT_COLS_WIDTH_MIN = 7
 _REPORT_COL_PAD = 2
+# Trace file (CSV) row format: Time, Vbat, Ishunt, Power
+# (bytes: trace files are written in binary mode, no text encoding layer)
+_TRACE_ROW_FORMAT = b"%d, %.9g, %.9g, %.9g\n"
+# Trace file write buffer size (bytes)
+_TRACE_FILE_BUFFER_SIZE = 1 << 20
+# Trace file rows formatted per block (samples)
+_TRACE_BLOCK_SIZE = 65536
 quiet= False
 
 def log(color, flag, msg, quiet):
@@ -77,17 +87,19 @@ def log(color, flag, msg, quiet):
     if quiet:
         pass
     else:
-        print("[" + color + flag + Style.RESET_ALL + "] " + msg)
+        # Single write (through colorama stdout wrapper, which strips
+        # colors when needed), no print() separators handling
+        sys.stdout.write("[%s%s%s] %s\n" % (color, flag, Style.RESET_ALL, msg))
 
 
-def exit_with_error(err):
-    """ Display completion message with error code before terminating execution.
+def log_completion(err):
+    """ Display completion message with error code.
 
     Args:
         err (int): an error code
 
     Returns:
-        None
+        int: the error code
 
     """
     print()
@@ -97,9 +109,37 @@ def exit_with_error(err):
     else:
         log(Fore.GREEN,
             "SUCCESS", "Script execution completed with success.", quiet)
-    print("\n< There will be a 'Segmentation fault (core dumped)' error message after this one. >")
-    print("< This is a kwown bug. Please ignore it. >\n")
-    exit(err)
+    return err
+
+
+def _ns_to_ms(values, origin=0):
+    """ Convert timestamps/durations from ns (int) to ms (float).
+
+    Args:
+        values (numpy array): timestamps/durations (in ns)
+        origin (int): timestamp to be used as origin (in ns)
+
+    Returns:
+        numpy array: converted values (in ms)
+
+    """
+    ms_values = np.subtract(values, origin, dtype=np.float64)
+    ms_values *= 1e-6
+    return ms_values
+
+
+def _ns_stats_to_ms(values):
+    """ Return min, max and average of durations in ns (int), in ms (float).
+        Only the 3 results are converted, not each duration.
+
+    Args:
+        values (numpy array): durations (in ns)
+
+    Returns:
+        tuple: (min, max, average) durations (in ms)
+
+    """
+    return (values.min() * 1e-6, values.max() * 1e-6, values.mean() * 1e-6)
 
 
 class IIODeviceCaptureThread(threading.Thread):
@@ -109,7 +149,8 @@ class IIODeviceCaptureThread(threading.Thread):
     ACME probe / IIO device.
 
     """
-    def __init__(self, cape, slot, channels, bufsize, duration, verbose_level):
+    def __init__(self, cape, slot, channels, bufsize, duration, verbose_level,
+                 refill_pool=None):
         """ Initialise IIODeviceCaptureThread class
 
         Args:
@@ -119,6 +160,9 @@ class IIODeviceCaptureThread(threading.Thread):
             bufsize (int): capture buffer size (in samples)
             duration (int): capture duration (in seconds)
             verbose_level (int): how much verbose the debug trace shall be
+            refill_pool (ThreadPoolExecutor): thread pool (shared by capture
+                        threads) used to refill capture buffer while
+                        processing samples. None to refill synchronously.
 
         Returns:
             None
@@ -137,6 +181,9 @@ class IIODeviceCaptureThread(threading.Thread):
         self._refill_end_times = None
         self._read_start_times = None
         self._read_end_times = None
+        self._samples_buffers = None
+        self._iterations = None
+        self._refill_pool = refill_pool
         self.shutdown_flag = threading.Event()
         self.shutdown_flag.clear()
         self.id = threading.Thread.getName(self)
@@ -148,13 +195,16 @@ class IIODeviceCaptureThread(threading.Thread):
         self._trace = MLTrace(verbose_level, "Thread Slot %u" % self._slot)
         self._trace.trace(
             2,
-            "Thread params: slot=%u channels=%s buffer size=%u duration=%us" % (
-                self._slot, self._channels, self._bufsize, self._duration))
+            "Thread params: slot=%u channels=%s buffer size=%u duration=%us",
+            self._slot, self._channels, self._bufsize, self._duration)
 
 
     def configure_capture(self):
         """ Configure capture parameters (enable channel(s),
             configure internal settings, ...)
+            Also warm up the running statistics kernels (compiled or
+            loaded from cache by Numba on first call), so that the first
+            capture loop iteration does not stall.
 
         Args:
             None
@@ -179,18 +229,67 @@ class IIODeviceCaptureThread(threading.Thread):
         for ch in self._channels:
             ret = self._cape.enable_capture_channel(self._slot, ch, True)
             if ret is False:
-                self._trace.trace(1, "Failed to enable %s capture!" % ch)
+                self._trace.trace(1, "Failed to enable %s capture!", ch)
                 return False
             else:
-                self._trace.trace(1, "%s capture enabled." % ch)
+                self._trace.trace(1, "%s capture enabled.", ch)
 
         # Allocate capture buffer
         if self._cape.allocate_capture_buffer(self._slot, self._bufsize) is False:
             self._trace.trace(1, "Failed to allocate capture buffer!")
             return False
         self._trace.trace(1, "Capture buffer allocated.")
+
+        # Preallocate samples buffers, as the number of samples to be
+        # captured is known (add 10% margin for timing jitter).
+        # One buffer per channel, in self._channels order.
+        # Raw samples are stored (scaled after capture, see
+        # process_samples()): 16-bit ADC samples take half the memory of
+        # float32 scaled samples, and there is no scaling in capture loop.
+        freq = self._cape.get_sampling_frequency(self._slot)
+        samples_count = int(freq * self._duration * 1.1) + self._bufsize
+        self._samples_buffers = []
+        for ch in self._channels:
+            if ch == "Time":
+                dtype = np.int64
+            else:
+                dtype = np.int16
+            self._samples_buffers.append(np.empty(samples_count, dtype=dtype))
+        self._trace.trace(2, "Samples buffers allocated (%u samples).", samples_count)
+
+        # Preallocate runtime stats timestamps buffers (in ns)
+        # (one buffer refill per capture loop iteration)
+        iterations = int(freq * self._duration / self._bufsize) + 4
+        self._refill_start_times = np.empty(iterations, dtype=np.int64)
+        self._refill_end_times = np.empty(iterations, dtype=np.int64)
+        self._read_start_times = np.empty(iterations, dtype=np.int64)
+        self._read_end_times = np.empty(iterations, dtype=np.int64)
+
+        # Warm up running statistics kernels (see run()): first call may
+        # take several hundred ms, long enough to overrun IIO buffers.
+        if "Vbat" in self._channels and "Ishunt" in self._channels:
+            warmup = np.zeros(1, dtype=np.int16)
+            RawVIPStats().update(warmup, warmup)
+            self._trace.trace(2, "Running statistics kernels warmed up.")
         return True
 
+    def _timed_refill(self):
+        """ Refill capture buffer, saving refill start/end timestamps.
+            Used to overlap buffer refills with samples processing.
+            Private function, not to be used outside of the class.
+
+        Args:
+            None
+
+        Returns:
+            tuple: (start time, end time, status)
+                   (timestamps from monotonic clock, in ns)
+
+        """
+        start = monotonic_ns()
+        ret = self._cape.refill_capture_buffer(self._slot)
+        return start, monotonic_ns(), ret
+
     def run(self):
         """ Capture samples for the selected duration. Save samples in a
             dictionary as described in get_samples() docstring.
@@ -203,48 +302,152 @@ class IIODeviceCaptureThread(threading.Thread):
 
         """
         self._failed = False
-        self._samples = {}
-        self._refill_start_times = []
-        self._refill_end_times = []
-        self._read_start_times = []
-        self._read_end_times = []
-        for ch in self._channels:
-            self._samples[ch] = None
-            self._samples["slot"] = self._slot
-            self._samples["channels"] = self._channels
-            self._samples["duration"] = self._duration
-
-        self._timestamp_thread_start = time()
+        self._iterations = 0
+        self._samples = {"slot": self._slot,
+                         "channels": self._channels,
+                         "duration": self._duration}
+        self._samples.update(dict.fromkeys(self._channels))
+        # Copy captured chunks into the preallocated samples buffers
+        # (growing arrays with np.append() copies all samples captured
+        # so far at each iteration).
+        # Per-channel capture state is stored in lists indexed as
+        # self._channels (cheaper than dictionaries in the capture loop).
+        counts = [0] * len(self._channels)
+        units = [None] * len(self._channels)
+        scales = [None] * len(self._channels)
+        # Compute Vbat/Ishunt/Power statistics chunk per chunk, while next
+        # buffer refill is in progress, rather than reducing all samples
+        # once capture is completed (see process_samples()).
+        if "Vbat" in self._channels and "Ishunt" in self._channels:
+            vbat_idx = self._channels.index("Vbat")
+            ishunt_idx = self._channels.index("Ishunt")
+            running_stats = RawVIPStats()
+        else:
+            running_stats = None
+
+        # Bind frequently used attributes/functions to local variables,
+        # saving attribute lookups in the capture loop
+        # Use monotonic clock (not affected by system clock updates)
+        _time = monotonic_ns
+        refill = self._cape.refill_capture_buffer
+        read = self._cape.read_capture_buffers
+        trace = self._trace.trace
+        debug_trace = self._verbose_level >= 3
+        slot = self._slot
+        channels = self._channels
+        duration = self._duration * 1000000000
+        shutdown_flag = self.shutdown_flag
+        samples_buffers = self._samples_buffers
+        refill_start_times = self._refill_start_times
+        refill_end_times = self._refill_end_times
+        read_start_times = self._read_start_times
+        read_end_times = self._read_end_times
+
+        refill_pool = self._refill_pool
+        pending_refill = None
+        if refill_pool is not None:
+            # Start refilling buffer in the refill thread pool
+            pending_refill = refill_pool.submit(self._timed_refill)
+
+        self._timestamp_thread_start = _time()
         elapsed_time = 0
-        while elapsed_time < self._duration and not (self.shutdown_flag.is_set()):
+        i = 0
+        while elapsed_time < duration and not shutdown_flag.is_set():
             # Capture samples
-            logging.debug("%s:" %(self.id))
-            self._refill_start_times.append(time())
-            ret = self._cape.refill_capture_buffer(self._slot)
-            self._refill_end_times.append(time())
+            # (debug log is always enabled: only log each iteration at
+            # verbose level 3, to keep log file writes out of the loop)
+            if debug_trace:
+                logging.debug("%s:", self.id)
+            if i == len(refill_start_times):
+                # More iterations than expected, grow timestamps buffers
+                refill_start_times = np.resize(refill_start_times, 2 * i)
+                refill_end_times = np.resize(refill_end_times, 2 * i)
+                read_start_times = np.resize(read_start_times, 2 * i)
+                read_end_times = np.resize(read_end_times, 2 * i)
+            if refill_pool is not None:
+                refill_start_times[i], refill_end_times[i], ret = pending_refill.result()
+            else:
+                refill_start_times[i] = _time()
+                ret = refill(slot)
+                refill_end_times[i] = _time()
             if ret != True:
-                self._trace.trace(1, "Warning: error during buffer refill!")
+                trace(1, "Warning: error during buffer refill!")
                 self._failed = True
             # Read captured samples
-            self._read_start_times.append(time())
-            for ch in self._channels:
-                s = self._cape.read_capture_buffer(self._slot, ch)
-                if s is None:
-                    self._trace.trace(1, "Warning: error during %s buffer read!" % ch)
-                    self._failed = True
-                if self._samples[ch] is not None:
-                    self._samples[ch]["samples"] = np.append(
-                        self._samples[ch]["samples"], s["samples"])
+            read_start_times[i] = _time()
+            # Read all channels at once: on error, no channel is saved,
+            # keeping channels samples aligned
+            buffers = read(slot, channels, True)
+            if buffers is None:
+                trace(1, "Warning: error during buffer read!")
+                self._failed = True
+                reads = ()
+            else:
+                reads = [buffers[ch] for ch in channels]
+            # Check capture completion once buffer is read, so that no
+            # refill is started if its samples would be dropped
+            # (a refill lasts as long as a buffer takes to be captured)
+            elapsed_time = _time() - self._timestamp_thread_start
+            if refill_pool is not None:
+                if elapsed_time < duration and not shutdown_flag.is_set():
+                    # Capture buffer fully read, refill it while
+                    # processing samples
+                    pending_refill = refill_pool.submit(self._timed_refill)
                 else:
-                    self._samples[ch] = {}
-                    self._samples[ch]["failed"] = False
-                    self._samples[ch]["unit"] = s["unit"]
-                    self._samples[ch]["samples"] = s["samples"]
-                self._trace.trace(3, "self._samples[%s] = %s" % (ch, str(self._samples[ch])))
-            self._read_end_times.append(time())
-            elapsed_time = time() - self._timestamp_thread_start
-        self._thread_execution_time = time() - self._timestamp_thread_start
-        self._samples[ch]["failed"] = self._failed
+                    pending_refill = None
+            for idx, s in enumerate(reads):
+                units[idx] = s["unit"]
+                scales[idx] = s["scale"]
+                samples = s["samples"]
+                buff = samples_buffers[idx]
+                start = counts[idx]
+                end = start + len(samples)
+                if end > len(buff):
+                    # Capture lasted longer than expected, grow buffer
+                    # (only copy samples captured so far: np.resize()
+                    # would also fill the new part with repeated data)
+                    trace(2, "%s samples buffer full, growing it.", channels[idx])
+                    grown_buff = np.empty(2 * end, dtype=buff.dtype)
+                    grown_buff[:start] = buff[:start]
+                    buff = grown_buff
+                    samples_buffers[idx] = buff
+                # Copy, as read buffer is reused by next read
+                buff[start:end] = samples
+                counts[idx] = end
+                if debug_trace:
+                    trace(3, "self._samples[%s] = %s", channels[idx], buff[start:end])
+            if running_stats is not None:
+                start = running_stats.count
+                end = counts[vbat_idx]
+                if end != counts[ishunt_idx]:
+                    # Vbat and Ishunt samples not aligned (read error),
+                    # statistics computed after capture
+                    running_stats = None
+                elif end > start:
+                    running_stats.update(samples_buffers[vbat_idx][start:end],
+                                         samples_buffers[ishunt_idx][start:end])
+            read_end_times[i] = _time()
+            i += 1
+        if pending_refill is not None:
+            # Capture interrupted, wait for the pending refill
+            pending_refill.result()
+        self._iterations = i
+        self._refill_start_times = refill_start_times
+        self._refill_end_times = refill_end_times
+        self._read_start_times = read_start_times
+        self._read_end_times = read_end_times
+        self._thread_execution_time = (_time() - self._timestamp_thread_start) / 1e9
+        # Save capture status in every channel (a channel with no samples
+        # captured at all is failed too)
+        for idx, ch in enumerate(self._channels):
+            self._samples[ch] = {}
+            self._samples[ch]["failed"] = self._failed or counts[idx] == 0
+            self._samples[ch]["unit"] = units[idx]
+            self._samples[ch]["scale"] = scales[idx]
+            self._samples[ch]["samples"] = samples_buffers[idx][:counts[idx]]
+        if running_stats is not None:
+            self._samples["stats"] = running_stats.get(
+                scales[vbat_idx], scales[ishunt_idx])
         self._trace.trace(1, "Thread done.")
         return True
 
@@ -262,81 +465,71 @@ class IIODeviceCaptureThread(threading.Thread):
 
         """
         self._trace.trace(1, "------------- Thread Runtime Stats -------------")
-        self._trace.trace(1, "Thread execution time: %s" % self._thread_execution_time)
-        # Convert list to numpy array
-        self._refill_start_times = np.asarray(self._refill_start_times)
-        self._refill_end_times = np.asarray(self._refill_end_times)
-        self._read_start_times = np.asarray(self._read_start_times)
-        self._read_end_times = np.asarray(self._read_end_times)
-        # Make timestamps relative to first one, and convert to ms
-        first_refill_start_time = self._refill_start_times[0]
-        self._refill_start_times -= first_refill_start_time
-        self._refill_start_times *= 1000
-        self._refill_end_times -= first_refill_start_time
-        self._refill_end_times *= 1000
-
-        first_read_start_time = self._read_start_times[0]
-        self._read_start_times -= first_read_start_time
-        self._read_start_times *= 1000
-        self._read_end_times -= first_read_start_time
-        self._read_end_times *= 1000
-        # Compute refill and read durations
+        self._trace.trace(1, "Thread execution time: %s", self._thread_execution_time)
+        # Drop unused timestamps buffers entries
+        self._refill_start_times = self._refill_start_times[:self._iterations]
+        self._refill_end_times = self._refill_end_times[:self._iterations]
+        self._read_start_times = self._read_start_times[:self._iterations]
+        self._read_end_times = self._read_end_times[:self._iterations]
+        # Compute refill and read durations, and delays between 2
+        # consecutive refills/reads, from raw timestamps (in ns)
         refill_durations = np.subtract(
             self._refill_end_times, self._refill_start_times)
         read_durations = np.subtract(
             self._read_end_times, self._read_start_times)
-
-        # Print time each time buffer was getting refilled
-        self._trace.trace(2, "Buffer Refill start times (ms): %s" % self._refill_start_times)
-        self._trace.trace(2, "Buffer Refill end times (ms): %s" % self._refill_end_times)
-        # Print time spent refilling buffer
-        self._trace.trace(2, "Buffer Refill duration (ms): %s" % refill_durations)
+        refill_delays = np.ediff1d(self._refill_start_times)
+        read_delays = np.ediff1d(self._read_start_times)
+
+        # Formatting numpy arrays is costly, do it only if printed
+        array_trace = self._verbose_level >= 2
+        if array_trace:
+            # Make timestamps relative to first one, and convert to ms
+            # (only needed for printing)
+            first_refill_start_time = self._refill_start_times[0]
+            self._refill_start_times = _ns_to_ms(
+                self._refill_start_times, first_refill_start_time)
+            self._refill_end_times = _ns_to_ms(
+                self._refill_end_times, first_refill_start_time)
+            first_read_start_time = self._read_start_times[0]
+            self._read_start_times = _ns_to_ms(
+                self._read_start_times, first_read_start_time)
+            self._read_end_times = _ns_to_ms(
+                self._read_end_times, first_read_start_time)
+
+            # Print time each time buffer was getting refilled
+            self._trace.trace(2, "Buffer Refill start times (ms): %s", self._refill_start_times)
+            self._trace.trace(2, "Buffer Refill end times (ms): %s", self._refill_end_times)
+            # Print time spent refilling buffer
+            self._trace.trace(2, "Buffer Refill duration (ms): %s", _ns_to_ms(refill_durations))
         if len(self._refill_start_times) > 1:
             # Print buffer refill time stats
-            refill_durations_min = np.amin(refill_durations)
-            refill_durations_max = np.amax(refill_durations)
-            refill_durations_avg = np.average(refill_durations)
-            self._trace.trace(1, "Buffer Refill Duration (ms): min=%s max=%s avg=%s" % (
-                refill_durations_min,
-                refill_durations_max,
-                refill_durations_avg))
+            self._trace.trace(1, "Buffer Refill Duration (ms): min=%s max=%s avg=%s",
+                              *_ns_stats_to_ms(refill_durations))
             # Print delays between 2 consecutive buffer refills
-            refill_delays = np.ediff1d(self._refill_start_times)
-            self._trace.trace(2, "Delay between 2 Buffer Refill (ms): %s" % refill_delays)
+            if array_trace:
+                self._trace.trace(2, "Delay between 2 Buffer Refill (ms): %s",
+                                  _ns_to_ms(refill_delays))
             # Print buffer refill delay stats
-            refill_delays_min = np.amin(refill_delays)
-            refill_delays_max = np.amax(refill_delays)
-            refill_delays_avg = np.average(refill_delays)
-            self._trace.trace(1, "Buffer Refill Delay (ms): min=%s max=%s avg=%s" % (
-                refill_delays_min,
-                refill_delays_max,
-                refill_delays_avg))
-
-        # Print time each time buffer was getting read
-        self._trace.trace(2, "Buffer Read start times (ms): %s" % self._read_start_times)
-        self._trace.trace(2, "Buffer Read end times (ms): %s" % self._read_end_times)
-        # Print time spent reading buffer
-        self._trace.trace(2, "Buffer Read duration (ms): %s" % read_durations)
+            self._trace.trace(1, "Buffer Refill Delay (ms): min=%s max=%s avg=%s",
+                              *_ns_stats_to_ms(refill_delays))
+
+        if array_trace:
+            # Print time each time buffer was getting read
+            self._trace.trace(2, "Buffer Read start times (ms): %s", self._read_start_times)
+            self._trace.trace(2, "Buffer Read end times (ms): %s", self._read_end_times)
+            # Print time spent reading buffer
+            self._trace.trace(2, "Buffer Read duration (ms): %s", _ns_to_ms(read_durations))
         if len(self._read_start_times) > 1:
             # Print buffer read time stats
-            read_durations_min = np.amin(read_durations)
-            read_durations_max = np.amax(read_durations)
-            read_durations_avg = np.average(read_durations)
-            self._trace.trace(1, "Buffer Read Duration (ms): min=%s max=%s avg=%s" % (
-                read_durations_min,
-                read_durations_max,
-                read_durations_avg))
+            self._trace.trace(1, "Buffer Read Duration (ms): min=%s max=%s avg=%s",
+                              *_ns_stats_to_ms(read_durations))
             # Print delays between 2 consecutive buffer reads
-            read_delays = np.ediff1d(self._read_start_times)
-            self._trace.trace(2, "Delay between 2 Buffer Read (ms): %s" % read_delays)
+            if array_trace:
+                self._trace.trace(2, "Delay between 2 Buffer Read (ms): %s",
+                                  _ns_to_ms(read_delays))
             # Print buffer read delay stats
-            read_delays_min = np.amin(read_delays)
-            read_delays_max = np.amax(read_delays)
-            read_delays_avg = np.average(read_delays)
-            self._trace.trace(1, "Buffer Read Delay (ms): min=%s max=%s avg=%s" % (
-                read_delays_min,
-                read_delays_max,
-                read_delays_avg))
+            self._trace.trace(1, "Buffer Read Delay (ms): min=%s max=%s avg=%s",
+                              *_ns_stats_to_ms(read_delays))
         self._trace.trace(1, "------------------------------------------------")
 
     def get_samples(self):
@@ -350,19 +543,151 @@ class IIODeviceCaptureThread(threading.Thread):
                 "slot" (int): ACME cape slot
                 "channels" (list of strings): channels captured
                 "duration" (int): capture duration (in seconds)
+                "stats" (tuple): Vbat, Ishunt and Power statistics computed
+                                 during capture (as returned by
+                                 acmestats.vip_stats()), only if Vbat and
+                                 Ishunt are captured
                 For each captured channel:
                 "capture channel name" (dict): a dictionary containing following key/data:
                     "failed" (bool): False if successful, True otherwise
-                    "samples" (array): captured samples
-                    "unit" (str): captured samples unit}}
+                    "samples" (array): captured raw samples (contiguous
+                                       view of the preallocated samples
+                                       buffer)
+                    "scale" (float): raw samples scale
+                                     (scaled sample = raw sample * scale)
+                    "unit" (str): captured samples unit (once scaled)}}
             E.g:
                 {'slot': 1, 'channels': ['Vbat', 'Ishunt'], 'duration': 3,
-                 'Vbat': {'failed': False, 'samples': array([ 1, 2, 3 ]), 'unit': 'mV'},
-                 'Ishunt': {'failed': False, 'samples': array([4, 5, 6 ]), 'unit': 'mA'}}
+                 'Vbat': {'failed': False, 'samples': array([ 1, 2, 3 ]),
+                          'scale': 1.25, 'unit': 'mV'},
+                 'Ishunt': {'failed': False, 'samples': array([4, 5, 6 ]),
+                            'scale': 0.1, 'unit': 'mA'}}
 
         """
         return self._samples
 
+def process_samples(samples, scale_samples=True):
+    """ Process the samples captured on a slot: make time samples relative
+        to first sample, scale raw samples, compute Vbat, Ishunt and Power
+        (P = Vbat * Ishunt) min, max, avg values.
+        Results are saved in 'samples' dictionary ("Power" channel,
+        "Vbat min", "Vbat max", "Vbat avg", "Ishunt min", ... keys).
+        Power samples are not materialized ("Power" channel "samples" is
+        None): statistics are computed on the fly, and Power samples are
+        computed block per block when saving trace file (see save_trace()).
+        Meant to be run in parallel for all slots (numpy and Numba kernels
+        release the GIL).
+
+    Args:
+        samples (dict): slot captured samples, as returned by
+                        IIODeviceCaptureThread.get_samples()
+        scale_samples (bool): False to keep raw samples (and their
+                              "scale") when scaled samples are not
+                              needed (no trace file, no samples dump).
+                              Ignored if statistics need scaled samples.
+
+    Returns:
+        None
+
+    """
+    # Make time samples relative to fist sample (in place: samples are a
+    # view of the capture thread buffer, not shared with anyone else)
+    timestamps = samples["Time"]["samples"]
+    if len(timestamps) != 0:
+        first_timestamp = int(timestamps[0])
+        np.subtract(timestamps, first_timestamp, out=timestamps,
+                    casting='unsafe')
+
+    # Compute min, max, avg values for Vbat, Ishunt and Power from raw
+    # (int16) samples if available and not already computed during
+    # capture: exact integer arithmetic, much faster than on scaled
+    # (float) samples.
+    stats = samples.pop("stats", None)
+    vbat = samples["Vbat"]
+    ishunt = samples["Ishunt"]
+    if (stats is None and "scale" in vbat and "scale" in ishunt and
+            np.issubdtype(vbat["samples"].dtype, np.integer) and
+            np.issubdtype(ishunt["samples"].dtype, np.integer)):
+        stats = raw_vip_stats(vbat["samples"], vbat["scale"],
+                              ishunt["samples"], ishunt["scale"])
+
+    # Scale raw samples (single pass, int16 -> float32 cast fused with
+    # scaling). Scaled samples are float32 (more than enough for ACME ADC
+    # resolution, and half the memory bandwidth of float64).
+    # Skipped if not needed: scaling allocates a float32 copy of samples.
+    for ch in samples["channels"]:
+        if ch == "Time" or (stats is not None and not scale_samples):
+            continue
+        scale = samples[ch].pop("scale", None)
+        if scale is not None and scale != 1.0:
+            samples[ch]["samples"] = np.multiply(
+                samples[ch]["samples"], scale, dtype=np.float32)
+        else:
+            samples[ch]["samples"] = samples[ch]["samples"].astype(
+                np.float32, copy=False)
+
+    # Compute Power (P = Vbat * Ishunt)
+    samples["Power"] = {}
+    samples["Power"]["unit"] = "mW" # FIXME
+    samples["Power"]["samples"] = None
+
+    # Compute min, max, avg values for Vbat, Ishunt and Power
+    # (from scaled samples, if not done from raw samples)
+    if stats is None:
+        stats = vip_stats(samples["Vbat"]["samples"],
+                          samples["Ishunt"]["samples"])
+    (samples["Vbat min"], samples["Vbat max"], samples["Vbat avg"],
+     samples["Ishunt min"], samples["Ishunt max"], samples["Ishunt avg"],
+     samples["Power min"], samples["Power max"], samples["Power avg"]) = stats
+
+
+def save_trace(filename, header, samples):
+    """ Save the samples captured on a slot to a trace file (CSV format).
+        Meant to be run in parallel for all slots (file writes release
+        the GIL).
+
+    Args:
+        filename (string): trace file name
+        header (string): trace file header (columns names)
+        samples (dict): slot processed samples (see process_samples())
+
+    Returns:
+        None
+
+    """
+    with open(filename, 'wb', buffering=_TRACE_FILE_BUFFER_SIZE) as of_trace:
+        of_trace.write((header + "\n").encode())
+        # Save samples in trace file.
+        # Convert sample arrays to lists (much faster than indexing numpy
+        # arrays sample per sample), and format rows with a single format
+        # string. Float samples (float32) are printed with 9 significant
+        # digits, enough to not lose any precision.
+        # Proceed block per block, computing Power samples of the block
+        # in a scratch buffer: keeps the working set small (lists of
+        # Python objects are much bigger than the arrays).
+        t = samples["Time"]["samples"]
+        vbat = samples["Vbat"]["samples"]
+        ishunt = samples["Ishunt"]["samples"]
+        power = samples["Power"]["samples"]
+        if power is None:
+            scratch = np.empty(min(len(vbat), _TRACE_BLOCK_SIZE),
+                               dtype=vbat.dtype)
+        for start in range(0, len(t), _TRACE_BLOCK_SIZE):
+            end = start + _TRACE_BLOCK_SIZE
+            if power is None:
+                vbat_block = vbat[start:end]
+                power_block = power_samples(
+                    vbat_block, ishunt[start:end],
+                    out=scratch[:len(vbat_block)])
+            else:
+                power_block = power[start:end]
+            # Join block rows and write them at once (a single large
+            # write, instead of one buffered write per row)
+            of_trace.write(b"".join(map(_TRACE_ROW_FORMAT.__mod__, zip(
+                t[start:end].tolist(), vbat[start:end].tolist(),
+                ishunt[start:end].tolist(), power_block.tolist()))))
+
+
 class ServiceExit(Exception):
     """
     Custom exception which is used to trigger the clean exit
@@ -371,33 +696,22 @@ class ServiceExit(Exception):
     pass
 
 def service_shutdown(signum, frame):
-    logging.debug('Caught signal %d' % signum)
+    logging.debug('Caught signal %d', signum)
     threads = threading.enumerate()
     for thread in threads:
-        logging.debug("%s: set event" %(threading.Thread.getName(thread)))
+        logging.debug("%s: set event", thread.name)
     raise ServiceExit
 
-def main():
-    """ Capture power measurements of selected ACME probe(s) over IIO link.
+def create_arg_parser():
+    """ Create the commandline arguments parser.
 
-    Refer to argparse code to learn about available commandline options.
+    Kept out of main() so that the parser may be built once and passed to
+    main() to parse several argument lists without being rebuilt each time.
 
     Returns:
-        int: error code (0 in case of success, a negative value otherwise)
+        argparse.ArgumentParser: commandline arguments parser
 
     """
-    err = -1
-
-    # Print application header
-    print(__app_name__ + " (version " + __version__ + ")\n")
-
-    # Colorama: reset style to default after each call to print
-    init(strip=True)
-
-    signal.signal(signal.SIGTERM, service_shutdown)
-    signal.signal(signal.SIGINT, service_shutdown)
-
-    # Parse user arguments
     parser = argparse.ArgumentParser(
         description='TODO',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -449,25 +763,27 @@ def main():
                         help='''Use a fake cape (SW-simulated,
                         no real HW access).
                         Use for development purposes only.''')
-    parser.add_argument('--verbose', '-v', action='count',
+    parser.add_argument('--verbose', '-v', action='count', default=0,
                         help='print debug traces (various levels v, vv, vvv)')
     parser.add_argument('--quiet', '-q', action="store_true", default=False,
                         dest='quiet', help='skip displaying the logs')
+    return parser
 
-    args = parser.parse_args()
-    quiet = args.quiet
-    log(Fore.GREEN, "OK", "Parse user arguments", quiet)
+def capture(args, iio_acme_cape, trace, err):
+    """ Capture power measurements of selected ACME probe(s), save and
+        display report and trace files.
 
-    # Use MLTrace to log execution details
-    trace = MLTrace(args.verbose)
-    trace.trace(2, "User args: " + str(args)[10:-1])
-    err = err - 1
+    Args:
+        args (argparse.Namespace): parsed user arguments
+        iio_acme_cape (IIOAcmeCape): ACME cape instance (not initialised)
+        trace (MLTrace): trace instance
+        err (int): error code of the first failing step
 
-    # Create an IIOAcmeCape instance
-    if args.fake is False:
-        iio_acme_cape = IIOAcmeCape(args.ip, args.verbose)
-    else:
-        iio_acme_cape = IIOFakeAcmeCape(args.ip, args.verbose)
+    Returns:
+        int: error code (0 in case of success, a negative value otherwise)
+
+    """
+    quiet = args.quiet
     max_rail_count = iio_acme_cape.get_slot_count()
 
     # Check arguments are valid
@@ -476,7 +792,7 @@ def main():
         assert args.count > 0
     except:
         log(Fore.RED, "FAILED", "Check user argument ('count')", quiet)
-        exit_with_error(err)
+        return err
 
     try:
         if args.slots is not None:
@@ -490,22 +806,22 @@ def main():
             args.slots = range(1, args.count + 1)
     except:
         log(Fore.RED, "FAILED", "Check user argument ('slots')", quiet)
-        exit_with_error(err)
+        return err
 
     try:
         if args.names is not None:
             args.names = args.names.split(',')
-            trace.trace(2, "args.names: %s" % args.names)
+            trace.trace(2, "args.names: %s", args.names)
             assert args.count == len(args.names)
     except:
         log(Fore.RED, "FAILED", "Check user argument ('names')", quiet)
-        exit_with_error(err)
+        return err
 
     try:
         assert args.duration > 0
     except:
         log(Fore.RED, "FAILED", "Check user argument ('duration')", quiet)
-        exit_with_error(err)
+        return err
     err = err - 1
     log(Fore.GREEN, "OK", "Check user arguments", quiet)
 
@@ -519,40 +835,35 @@ def main():
             outdir = os.path.join(os.path.expanduser('~/pyacmecapture'), now)
         else:
             outdir = args.outdir
-        trace.trace(1, "Output directory: %s" % outdir)
+        trace.trace(1, "Output directory: %s", outdir)
 
         if args.out is None:
             report_filename = os.path.join(outdir, now + "-report.txt")
         else:
             report_filename = os.path.join(outdir, args.out + "-report.txt")
-        trace.trace(1, "Report filename: %s" % report_filename)
+        trace.trace(1, "Report filename: %s", report_filename)
 
+        if os.path.isdir(outdir):
+            trace.trace(1, "Directory '%s' already exists.", outdir)
         try:
-            os.makedirs(outdir)
-        except OSError as e:
-            if e.errno == os.errno.EEXIST:
-                trace.trace(1, "Directory '%s' already exists." % outdir)
-            else:
-                log(Fore.RED, "FAILED", "Create output directory", quiet)
-                trace.trace(2, traceback.format_exc())
-                exit_with_error(err)
+            os.makedirs(outdir, exist_ok=True)
         except:
             log(Fore.RED, "FAILED", "Create output directory", quiet)
             trace.trace(2, traceback.format_exc())
-            exit_with_error(err)
+            return err
         log(Fore.GREEN, "OK", "Create output directory", quiet)
 
     # Check ACME Cape is reachable
     if iio_acme_cape.is_up() != True:
         log(Fore.RED, "FAILED", "Ping ACME", quiet)
-        exit_with_error(err)
+        return err
     log(Fore.GREEN, "OK", "Ping ACME", quiet)
     err = err - 1
 
     # Init IIOAcmeCape instance
     if iio_acme_cape.init() != True:
         log(Fore.RED, "FAILED", "Init ACME IIO Context", quiet)
-        exit_with_error(err)
+        return err
     log(Fore.GREEN, "OK", "Init ACME Cape instance", quiet)
     err = err - 1
 
@@ -566,25 +877,50 @@ def main():
         else:
             log(Fore.GREEN, "OK", "Detect probe in slot %u" % i, quiet)
     if failed is True:
-        exit_with_error(err)
+        return err
     err = err - 1
 
     # Create and configure capture threads
+    # Buffer refills (blocking) are run in a thread pool shared by
+    # capture threads, one worker per slot
+    if _OVERLAPPED_REFILLS:
+        refill_pool = ThreadPoolExecutor(max_workers=len(args.slots))
+    else:
+        refill_pool = None
+    # Probes are configured concurrently (each configuration step is a
+    # blocking round-trip to the ACME cape), results checked in order.
+    def create_capture_thread(slot):
+        thread = IIODeviceCaptureThread(
+            iio_acme_cape, slot, _CAPTURED_CHANNELS, args.bufsize,
+            args.duration, args.verbose, refill_pool)
+        return thread, thread.configure_capture()
+
     threads = []
+    # On error, capture threads must be stopped before the IIO resources
+    # they use are released
+    def abort_capture():
+        for thread in threads:
+            thread.shutdown_flag.set()
+            if thread.is_alive():
+                thread.join()
+        if refill_pool is not None:
+            refill_pool.shutdown()
+
     failed = False
-    for i in args.slots:
+    with ThreadPoolExecutor(max_workers=len(args.slots)) as pool:
+        configs = [pool.submit(create_capture_thread, i) for i in args.slots]
+    for i, config in zip(args.slots, configs):
         try:
-            thread = IIODeviceCaptureThread(
-                iio_acme_cape, i, _CAPTURED_CHANNELS, args.bufsize,
-                args.duration, args.verbose)
-            ret = thread.configure_capture()
+            thread, ret = config.result()
         except:
             log(Fore.RED, "FAILED", "Configure capture thread for probe in slot #%u" % i, quiet)
             trace.trace(2, traceback.format_exc())
-            exit_with_error(err)
+            abort_capture()
+            return err
         if ret is False:
             log(Fore.RED, "FAILED", "Configure capture thread for probe in slot #%u" % i, quiet)
-            exit_with_error(err)
+            abort_capture()
+            return err
         threads.append(thread)
         log(Fore.GREEN, "OK", "Configure capture thread for probe in slot #%u" % i, quiet)
     err = err - 1
@@ -605,7 +941,8 @@ def main():
     except:
         log(Fore.RED, "FAILED", "Start capture", quiet)
         trace.trace(2, traceback.format_exc())
-        exit_with_error(err)
+        abort_capture()
+        return err
     log(Fore.GREEN, "OK", "Start capture", quiet)
     err = err - 1
 
@@ -613,6 +950,8 @@ def main():
 
     for thread in threads:
         thread.join()
+    if refill_pool is not None:
+        refill_pool.shutdown()
     log(Fore.GREEN, "OK", "Capture threads completed", quiet)
 
     if args.verbose >= 1:
@@ -624,58 +963,43 @@ def main():
     data = []
     for thread in threads:
         samples = thread.get_samples()
-        trace.trace(3, "Slot %u captured data: %s" % (samples['slot'], samples))
+        trace.trace(3, "Slot %u captured data: %s", samples['slot'], samples)
         data.append(samples)
     log(Fore.GREEN, "OK", "Retrieve captured samples", quiet)
 
-    # Process samples
-    for i in range(args.count):
-        slot = data[i]['slot']
-
-        # Make time samples relative to fist sample
-        first_timestamp = data[i]["Time"]["samples"][0]
-        data[i]["Time"]["samples"] -= first_timestamp
-        timestamp_diffs = np.ediff1d(data[i]["Time"]["samples"])
-        timestamp_diffs_ms = timestamp_diffs / 1000000
-        trace.trace(3, "Slot %u timestamp_diffs (ms): %s" % (
-            slot, timestamp_diffs_ms))
-        timestamp_diffs_min = np.amin(timestamp_diffs_ms)
-        timestamp_diffs_max = np.amax(timestamp_diffs_ms)
-        timestamp_diffs_avg = np.average(timestamp_diffs_ms)
+    # Process samples (slots processed in parallel)
+    # Scaled samples only needed to save trace files and dump samples
+    scale_samples = args.nofile is False or args.verbose >= 3
+    with ThreadPoolExecutor(max_workers=args.count) as pool:
+        list(pool.map(process_samples, data, [scale_samples] * len(data)))
+    # Timestamps diagnostics (only computed if printed)
+    for samples in data:
+        if args.verbose < 1:
+            break
+        slot = samples['slot']
+        timestamps = samples["Time"]["samples"]
+        sample_count = len(timestamps)
+        if sample_count < 2:
+            trace.trace(1, "Slot %u: not enough samples captured.", slot)
+            continue
+        # Time differences between 2 consecutive samples (in ns)
+        if args.verbose >= 3:
+            trace.trace(3, "Slot %u timestamp_diffs (ms): %s", slot,
+                        _ns_to_ms(np.subtract(timestamps[1:], timestamps[:-1])))
         trace.trace(1, "Slot %u Time difference between 2 samples (ms): "
-                       "min=%u max=%u avg=%u" % (slot,
-                                                 timestamp_diffs_min,
-                                                 timestamp_diffs_max,
-                                                 timestamp_diffs_avg))
-        real_capture_time_ms = data[i]["Time"]["samples"][-1] / 1000000
-        sample_count = len(data[i]["Time"]["samples"])
+                       "min=%u max=%u avg=%u", slot,
+                    *(d * 1e-6 for d in diff_stats(timestamps)))
+        real_capture_time_ms = timestamps[-1] / 1000000
         real_sampling_rate = sample_count / (real_capture_time_ms / 1000.0)
         trace.trace(1,
-                    "Slot %u: real capture duration: %u ms (%u samples)" % (
-                        slot, real_capture_time_ms, sample_count))
+                    "Slot %u: real capture duration: %u ms (%u samples)",
+                    slot, real_capture_time_ms, sample_count)
         trace.trace(1,
-                    "Slot %u: real sampling rate: %u Hz" % (
-                        slot, real_sampling_rate))
-
-        # Compute Power (P = Vbat * Ishunt)
-        data[i]["Power"] = {}
-        data[i]["Power"]["unit"] = "mW" # FIXME
-        data[i]["Power"]["samples"] = np.multiply(
-            data[i]["Vbat"]["samples"], data[i]["Ishunt"]["samples"])
-        data[i]["Power"]["samples"] /= 1000.0
-        trace.trace(3, "Slot %u power samples: %s" % (
-            slot, data[i]["Power"]["samples"]))
-
-        # Compute min, max, avg values for Vbat, Ishunt and Power
-        data[i]["Vbat min"] = np.amin(data[i]["Vbat"]["samples"])
-        data[i]["Vbat max"] = np.amax(data[i]["Vbat"]["samples"])
-        data[i]["Vbat avg"] = np.average(data[i]["Vbat"]["samples"])
-        data[i]["Ishunt min"] = np.amin(data[i]["Ishunt"]["samples"])
-        data[i]["Ishunt max"] = np.amax(data[i]["Ishunt"]["samples"])
-        data[i]["Ishunt avg"] = np.average(data[i]["Ishunt"]["samples"])
-        data[i]["Power min"] = np.amin(data[i]["Power"]["samples"])
-        data[i]["Power max"] = np.amax(data[i]["Power"]["samples"])
-        data[i]["Power avg"] = np.average(data[i]["Power"]["samples"])
+                    "Slot %u: real sampling rate: %u Hz",
+                    slot, real_sampling_rate)
+        if args.verbose >= 3:
+            trace.trace(3, "Slot %u power samples: %s", slot, power_samples(
+                samples["Vbat"]["samples"], samples["Ishunt"]["samples"]))
     log(Fore.GREEN, "OK", "Process samples", quiet)
 
     # Generate report
@@ -709,59 +1033,59 @@ def main():
     report.append("Power Rails: %u" % args.count)
     report.append("Duration: %us\n" % args.duration)
 
+    # Power rails labels, used in report, trace files names and headers
+    # (power rail name if provided, slot otherwise)
+    slots = [data[i]['slot'] for i in range(args.count)]
+    if args.names is not None:
+        rail_labels = args.names[:args.count]
+        rail_file_labels = rail_labels
+    else:
+        rail_labels = ["Slot %u" % slot for slot in slots]
+        rail_file_labels = ["Slot_%u" % slot for slot in slots]
+
     # Adjust column width with name so that it's never truncated
-    cols_width = []
-    for i in range(args.count):
-        if args.names is not None:
-            cols_width.append(_REPORT_COL_PAD + max(
-                _REPORT_COLS_WIDTH_MIN, len(args.names[i])))
-        else:
-            cols_width.append(_REPORT_COL_PAD + _REPORT_COLS_WIDTH_MIN)
+    if args.names is not None:
+        cols_width = [_REPORT_COL_PAD + max(_REPORT_COLS_WIDTH_MIN, len(name))
+                      for name in args.names[:args.count]]
+    else:
+        cols_width = [_REPORT_COL_PAD + _REPORT_COLS_WIDTH_MIN] * args.count
 
     # Generate report
+    # Get 'Slot' and 'Shunt' rows cells once, other rows cells are
+    # formatted from data keys (no cell for section rows).
+    if args.names is not None:
+        slot_cells = rail_labels
+    else:
+        slot_cells = [str(slot) for slot in slots]
+    shunt_cells = [str(iio_acme_cape.get_shunt(slot) / 1000) for slot in slots]
     for r in table['rows']:
-        s = r.ljust(_REPORT_1ST_COL_WIDTH)
-        for i in range(args.count):
-            slot = data[i]['slot']
-            if r == 'Slot':
-                if args.names is not None:
-                    s += args.names[i].rjust(cols_width[i])
-                else:
-                    s += str(slot).rjust(cols_width[i])
-            elif r == 'Shunt (mohm)':
-                s += str(iio_acme_cape.get_shunt(slot) / 1000).rjust(
-                    cols_width[i])
-            elif table['data_keys'][r] is not None:
-                s += format(data[i][table['data_keys'][r]], '.1f').rjust(
-                    cols_width[i])
-        report.append(s)
+        if r == 'Slot':
+            cells = ["%*s" % (w, c) for w, c in zip(cols_width, slot_cells)]
+        elif r == 'Shunt (mohm)':
+            cells = ["%*s" % (w, c) for w, c in zip(cols_width, shunt_cells)]
+        elif table['data_keys'][r] is not None:
+            key = table['data_keys'][r]
+            cells = ["%*.1f" % (w, d[key]) for w, d in zip(cols_width, data)]
+        else:
+            cells = []
+        report.append("%-*s" % (_REPORT_1ST_COL_WIDTH, r) + "".join(cells))
 
     # Add output filenames to report
     trace_filenames = []
     if args.nofile is False:
         report.append("\nReport file: %s" % report_filename)
+        # Trace filenames: <outdir>/<now|out>_<name|Slot_N>.csv
+        # (trace_filenames is then used as is to save traces)
+        if args.out is None:
+            trace_filename_prefix = os.path.join(outdir, now + "_")
+        else:
+            trace_filename_prefix = os.path.join(outdir, args.out + "_")
         for i in range(args.count):
-            slot = data[i]['slot']
-            if args.out is None:
-                trace_filename = now
-            else:
-                trace_filename = args.out
-            trace_filename += "_"
-            if args.names is not None:
-                trace_filename += args.names[i]
-            else:
-                trace_filename += "Slot_%u" % slot
-            trace_filename += ".csv"
-            trace_filename = os.path.join(outdir, trace_filename)
-            if args.names is not None:
-                report.append("%s Trace file: %s" % (
-                    args.names[i], trace_filename))
-            else:
-                report.append("Slot %s Trace file: %s" % (
-                    slot, trace_filename))
+            trace_filename = trace_filename_prefix + rail_file_labels[i] + ".csv"
+            report.append("%s Trace file: %s" % (rail_labels[i], trace_filename))
             trace_filenames.append(trace_filename)
-    report_max_length = len(max(report, key=len))
-    dash_count = (report_max_length - len(" Power Measurement Report ")) / 2
+    report_max_length = max(map(len, report))
+    dash_count = (report_max_length - len(" Power Measurement Report ")) // 2
 
     # Add dashlines at beginning and end of report
     if report_max_length % 2 == 0:
@@ -775,70 +1099,116 @@ def main():
                       " Power Measurement Report " +
                       "-" * (dash_count + 1))
     report.append("-" * report_max_length)
+    # Join report lines once (same text saved to file and displayed)
+    report_text = "\n".join(report) + "\n"
 
     # Save report to file
     if args.nofile is False:
         try:
-            of_report = open(report_filename, 'w')
-            for line in report:
-                print(line, file=of_report)
-            of_report.close()
+            with open(report_filename, 'w') as of_report:
+                of_report.write(report_text)
         except:
-            log(Fore.RED, "FAILED", "Save Power Measurement report")
+            log(Fore.RED, "FAILED", "Save Power Measurement report", quiet)
             trace.trace(2, traceback.format_exc())
-            exit_with_error(err)
+            return err
         log(Fore.GREEN, "OK",
             "Save Power Measurement report", quiet)
 
     # Save Power Measurement trace to file (CSV format)
+    # Trace files are written in parallel threads, so that disk I/O of a
+    # slot trace file overlaps with the formatting of the others.
     if args.nofile is False:
+        headers = []
         for i in range(args.count):
-            slot = data[i]['slot']
-            trace.trace(1, "Trace file: %s" % trace_filenames[i])
-            try:
-                of_trace = open(trace_filenames[i], 'w')
-            except:
-                log(Fore.RED, "FAILED", "Create output trace file", quiet)
-                trace.trace(2, traceback.format_exc())
-                exit_with_error(err)
-
+            trace.trace(1, "Trace file: %s", trace_filenames[i])
             # Format trace header (name columns)
-            if args.names is not None:
-                s = "Time (%s), %s Voltage (%s), %s Current (%s), %s Power (%s)" % (
-                    data[i]["Time"]["unit"],
-                    args.names[i], data[i]["Vbat"]["unit"],
-                    args.names[i], data[i]["Ishunt"]["unit"],
-                    args.names[i], data[i]["Power"]["unit"])
-            else:
-                s = "Time (%s), Slot %u Voltage (%s), Slot %u Current (%s), Slot %u Power (%s)" % (
-                    data[i]["Time"]["unit"],
-                    slot, data[i]["Vbat"]["unit"],
-                    slot, data[i]["Ishunt"]["unit"],
-                    slot, data[i]["Power"]["unit"])
-            print(s, file=of_trace)
-            # Save samples in trace file
-            for j in range(len(data[i]["Ishunt"]["samples"])):
-                s = "%s, %s, %s, %s" % (
-                    data[i]["Time"]["samples"][j],
-                    data[i]["Vbat"]["samples"][j],
-                    data[i]["Ishunt"]["samples"][j],
-                    data[i]["Power"]["samples"][j])
-                print(s, file=of_trace)
-            of_trace.close()
-            if args.names is not None:
-                log(Fore.GREEN, "OK",
-                    "Save %s Power Measurement Trace" % args.names[i], quiet)
-            else:
-                log(Fore.GREEN, "OK",
-                    "Save Slot %u Power Measurement Trace" % slot, quiet)
-
-    # Display report
-    print()
-    for line in report:
-        print(line)
+            label = rail_labels[i]
+            samples = data[i]
+            s = "Time (%s), %s Voltage (%s), %s Current (%s), %s Power (%s)" % (
+                samples["Time"]["unit"],
+                label, samples["Vbat"]["unit"],
+                label, samples["Ishunt"]["unit"],
+                label, samples["Power"]["unit"])
+            headers.append(s)
+        with ThreadPoolExecutor(max_workers=args.count) as pool:
+            saves = list(map(pool.submit, [save_trace] * args.count,
+                             trace_filenames, headers, data))
+            for i in range(args.count):
+                msg = "Save %s Power Measurement Trace" % rail_labels[i]
+                try:
+                    saves[i].result()
+                except:
+                    log(Fore.RED, "FAILED", msg, quiet)
+                    trace.trace(2, traceback.format_exc())
+                    return err
+                log(Fore.GREEN, "OK", msg, quiet)
+
+    # Display report (single write of the pre-joined report lines)
+    sys.stdout.write("\n" + report_text)
 
     # Done
-    exit_with_error(0)
+    return 0
+
+
+def main(argv=None, parser=None):
+    """ Capture power measurements of selected ACME probe(s) over IIO link.
+
+    Refer to create_arg_parser() to learn about available commandline options.
+
+    Args:
+        argv (list of strings): commandline arguments to parse
+                                (default: sys.argv[1:]).
+        parser (argparse.ArgumentParser): commandline arguments parser,
+                                          as returned by create_arg_parser()
+                                          (default: a new one is created).
+
+    Returns:
+        int: error code (0 in case of success, a negative value otherwise)
+
+    """
+    err = -1
+
+    # Print application header
+    print(__app_name__ + " (version " + __version__ + ")\n")
+
+    # Colorama: reset style to default after each call to print
+    init(strip=True)
+
+    signal.signal(signal.SIGTERM, service_shutdown)
+    signal.signal(signal.SIGINT, service_shutdown)
+
+    # Parse user arguments
+    if parser is None:
+        parser = create_arg_parser()
+    args = parser.parse_args(argv)
+    quiet = args.quiet
+    log(Fore.GREEN, "OK", "Parse user arguments", quiet)
+
+    # Use MLTrace to log execution details
+    trace = MLTrace(args.verbose)
+    trace.trace(2, "User args: " + str(args)[10:-1])
+    err = err - 1
+
+    # Create an IIOAcmeCape instance
+    if args.fake is False:
+        iio_acme_cape = IIOAcmeCape(args.ip, args.verbose)
+    else:
+        iio_acme_cape = IIOFakeAcmeCape(args.ip, args.verbose,
+                                        _FAKE_REFILL_LATENCY)
+
+    # Capture, then release IIO resources (whatever the outcome)
+    try:
+        err = capture(args, iio_acme_cape, trace, err)
+    finally:
+        iio_acme_cape.deinit()
+    return log_completion(err)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    ret = main()
+    # IIO resources already released (see main()): skip Python interpreter
+    # teardown, as libiio objects destruction at interpreter exit crashes
+    # (segmentation fault). Flush logs and outputs first.
+    logging.shutdown()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(ret)
\ No newline at end of file